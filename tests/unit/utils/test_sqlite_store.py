@@ -2,7 +2,9 @@
 Tests for `vinegar.utils.sqlite_store`.
 """
 
+import json
 import os.path
+import sqlite3
 import unittest
 
 from contextlib import contextmanager
@@ -16,6 +18,50 @@ class TestDataStore(unittest.TestCase):
     Tests for the `DataStore`.
     """
 
+    def test_analyze(self):
+        """
+        Test the `~DataStore.analyze` method.
+        """
+
+        def get_statistics(db_file):
+            # We use a separate connection, so that we see what has actually
+            # been written to the database file.
+            connection = sqlite3.connect(db_file)
+            try:
+                has_table = connection.execute(
+                    "SELECT count(*) FROM sqlite_master WHERE type='table' "
+                    "AND name='sqlite_stat1';"
+                ).fetchone()[0]
+                if not has_table:
+                    return None
+                return connection.execute(
+                    "SELECT idx FROM sqlite_stat1 WHERE tbl='system_data';"
+                ).fetchall()
+            finally:
+                connection.close()
+
+        with TemporaryDirectory() as tmpdir:
+            db_file = os.path.join(tmpdir, "test.db")
+            with open_data_store(db_file) as store:
+                for index in range(100):
+                    store.set_value(f"system{index}", "a", index % 3)
+                # Before calling analyze, there should not be any statistics.
+                self.assertIsNone(get_statistics(db_file))
+                store.analyze()
+                # After calling analyze, there should be statistics for the
+                # table that stores the data.
+                statistics = get_statistics(db_file)
+                self.assertIsNotNone(statistics)
+                self.assertTrue(len(statistics) > 0)
+                # Analyzing the data must not have any effect on the data
+                # itself.
+                self.assertEqual(
+                    [f"system{index}" for index in range(1, 100, 3)],
+                    sorted(
+                        store.find_systems("a", 1), key=lambda s: int(s[6:])
+                    ),
+                )
+
     def test_delete_data(self):
         """
         Test the `~DataStore.delete_data` method.
@@ -91,6 +137,89 @@ class TestDataStore(unittest.TestCase):
             # system_id2.
             self.assertEqual([system_id2], store.find_systems("b", 1234))
 
+    def test_find_systems_legacy_encoding(self):
+        """
+        Test that `~DataStore.find_systems` finds values that have been stored
+        by older versions, which used the default settings of ``json.dumps``.
+        """
+        with TemporaryDirectory() as tmpdir:
+            db_file = os.path.join(tmpdir, "test.db")
+            value = {"abc": ["d\u00e9f", 1]}
+            # We create the tables and store a value using the current format.
+            with open_data_store(db_file) as store:
+                store.set_value("system1", "a", value)
+            # Then, we store the same value for a second system, using the
+            # format that was used by older versions.
+            connection = sqlite3.connect(db_file, isolation_level=None)
+            try:
+                connection.execute(
+                    "INSERT INTO system_data (system_id, key, value) VALUES "
+                    "(?, ?, ?);",
+                    ("system2", "a", json.dumps(value)),
+                )
+                # The values stored by the current version must use the same
+                # format, so that older versions can find them as well.
+                stored_value = connection.execute(
+                    "SELECT value FROM system_data WHERE system_id=?;",
+                    ("system1",),
+                ).fetchone()[0]
+            finally:
+                connection.close()
+            self.assertEqual(json.dumps(value), stored_value)
+            with open_data_store(db_file) as store:
+                self.assertEqual(
+                    ["system1", "system2"], store.find_systems("a", value)
+                )
+                self.assertEqual(value, store.get_value("system2", "a"))
+
+    def test_find_systems_lone_surrogate(self):
+        """
+        Test that strings containing a lone surrogate can be stored and found.
+        """
+        with _temporary_data_store() as store:
+            store.set_value("system1", "a", "\ud800")
+            self.assertEqual("\ud800", store.get_value("system1", "a"))
+            self.assertEqual(["system1"], store.find_systems("a", "\ud800"))
+
+    def test_find_systems_uses_index(self):
+        """
+        Test that the query used by `~DataStore.find_systems` can be answered
+        from the index alone and that the redundant index created by older
+        versions is removed.
+        """
+        with TemporaryDirectory() as tmpdir:
+            db_file = os.path.join(tmpdir, "test.db")
+            with sqlite3.connect(db_file) as connection:
+                connection.executescript("""
+                    CREATE TABLE system_data (
+                        system_id TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        PRIMARY KEY (system_id, key)) WITHOUT ROWID;
+                    CREATE INDEX system_id_index ON system_data (system_id);
+                    """)
+            connection.close()
+            with open_data_store(db_file) as store:
+                store.set_value("system1", "a", 1)
+                self.assertEqual(["system1"], store.find_systems("a", 1))
+            with sqlite3.connect(db_file) as connection:
+                index_names = [
+                    row[0]
+                    for row in connection.execute(
+                        "SELECT name FROM sqlite_master WHERE type='index' "
+                        "AND tbl_name='system_data';"
+                    )
+                ]
+                plan = connection.execute(
+                    "EXPLAIN QUERY PLAN SELECT system_id FROM system_data "
+                    "WHERE key=? AND value=?;",
+                    ("a", "1"),
+                ).fetchall()
+            connection.close()
+            self.assertNotIn("system_id_index", index_names)
+            self.assertIn("key_value_index", index_names)
+            self.assertIn("COVERING INDEX key_value_index", str(plan))
+
     def test_get_data(self):
         """
         Test the `~DataStore.get_data` method.
@@ -131,6 +260,58 @@ class TestDataStore(unittest.TestCase):
             with self.assertRaises(KeyError):
                 store.get_value("system3", "a")
 
+    def test_iter_data(self):
+        """
+        Test the `~DataStore.iter_data` method.
+        """
+        with _temporary_data_store() as store:
+            store.set_value("system1", "b", [456])
+            store.set_value("system1", "a", 123)
+            store.set_value("system2", "a", 789)
+            # The items should be sorted by key.
+            with store.iter_data("system1") as items:
+                self.assertEqual([("a", 123), ("b", [456])], list(items))
+            with store.iter_data("system3") as items:
+                self.assertEqual([], list(items))
+            # It should be possible to stop iterating early and the data store
+            # should be usable again after leaving the with block.
+            with store.iter_data("system1") as items:
+                self.assertEqual(("a", 123), next(items))
+            self.assertEqual({"a": 789}, store.get_data("system2"))
+            # The rows are fetched in batches, so we also test a system with
+            # more rows than fit into a single batch.
+            expected_items = [
+                (f"key{index:03}", index) for index in range(150)
+            ]
+            for key, value in expected_items:
+                store.set_value("system4", key, value)
+            with store.iter_data("system4") as items:
+                self.assertEqual(expected_items, list(items))
+            # Other methods may be used inside the with block.
+            with store.iter_data("system1") as items:
+                for key, value in items:
+                    self.assertEqual(value, store.get_value("system1", key))
+
+    def test_iter_find_systems(self):
+        """
+        Test the `~DataStore.iter_find_systems` method.
+        """
+        with _temporary_data_store() as store:
+            store.set_value("system2", "a", 123)
+            store.set_value("system1", "a", 123)
+            store.set_value("system3", "a", 456)
+            with store.iter_find_systems("a", 123) as systems:
+                self.assertEqual(["system1", "system2"], list(systems))
+            with store.iter_find_systems("b", 123) as systems:
+                self.assertEqual([], list(systems))
+            with store.iter_find_systems("a", 123) as systems:
+                self.assertEqual("system1", next(systems))
+            self.assertEqual(["system3"], store.find_systems("a", 456))
+            # Other methods may be used inside the with block.
+            with store.iter_find_systems("a", 123) as systems:
+                for system_id in systems:
+                    self.assertEqual(123, store.get_value(system_id, "a"))
+
     def test_list_systems(self):
         """
         Test the `~DataStore.list_systems` method.
@@ -193,6 +374,12 @@ class TestDataStore(unittest.TestCase):
             value["x"] = [value]
             with self.assertRaises(ValueError):
                 store.set_value(system_id, key, value)
+            # Referring to the same object multiple times is fine, as long as
+            # the references do not form a loop.
+            shared_value = {"a": [1, 2]}
+            value = [shared_value, {"x": shared_value, "y": [shared_value]}]
+            store.set_value(system_id, key, value)
+            self.assertEqual(value, store.get_value(system_id, key))
             # There are also limitations regarding the allowed types. We only
             # allow values of type bool, int, float, dict (if the keys are of
             # type str and values are one of the supported types), list (if the
@@ -4,7 +4,54 @@ Tests for `vinegar.utils.system_matcher`.
 
 import unittest
 
-from vinegar.utils.system_matcher import match, matcher
+from vinegar.utils.system_matcher import (
+    cache_clear,
+    cache_info,
+    match,
+    matcher,
+    precompile,
+)
+
+
+class TestCache(unittest.TestCase):
+    """
+    Tests for the `cache_clear`, `cache_info`, and `precompile` functions.
+    """
+
+    def test_cache(self):
+        """
+        Test that the cache statistics reflect the use of the cache.
+        """
+        cache_clear()
+        info = cache_info()
+        self.assertEqual(0, info.hits)
+        self.assertEqual(0, info.misses)
+        self.assertEqual(0, info.currsize)
+        match("abc", system_id="abc")
+        match("abc", system_id="def")
+        matcher("abc")
+        match("def", system_id="def")
+        info = cache_info()
+        self.assertEqual(2, info.hits)
+        self.assertEqual(2, info.misses)
+        self.assertEqual(2, info.currsize)
+        cache_clear()
+        self.assertEqual(0, cache_info().currsize)
+
+    def test_precompile(self):
+        """
+        Test that `precompile` adds the expressions to the cache.
+        """
+        cache_clear()
+        precompile(["abc", "def or ghi", "abc"])
+        info = cache_info()
+        self.assertEqual(2, info.misses)
+        self.assertEqual(2, info.currsize)
+        self.assertTrue(match("def or ghi", system_id="ghi"))
+        self.assertEqual(1, cache_info().hits)
+        with self.assertRaises(ValueError):
+            precompile(["abc", "a and"])
+        cache_clear()
 
 
 class TestMatch(unittest.TestCase):
@@ -232,6 +279,122 @@ class TestMatch(unittest.TestCase):
         self.assertFalse(match(pattern, system_id="klj"))
         self.assertTrue(match(pattern, system_id="456"))
         self.assertFalse(match(pattern, system_id="789"))
+        # Patterns that are combined with "or" might internally be merged into
+        # a single regular expression. This must work for patterns with
+        # different flags and types and it must not change the result.
+        pattern = (
+            "@id_glob@abc* or (@id_literal/i@DEF or @id_re@'g(h)\\\\1') or "
+            "@data_glob/i:key@X* or @data_literal:key@y or "
+            "@data_literal:other@z"
+        )
+        self.assertTrue(match(pattern, system_id="abc1"))
+        self.assertFalse(match(pattern, system_id="ABC1"))
+        self.assertTrue(match(pattern, system_id="def"))
+        self.assertFalse(match(pattern, system_id="def1"))
+        self.assertTrue(match(pattern, system_id="ghh"))
+        self.assertFalse(match(pattern, system_id="gh\\1"))
+        self.assertTrue(match(pattern, system_data={"key": "x1"}))
+        self.assertTrue(match(pattern, system_data={"key": "y"}))
+        self.assertFalse(match(pattern, system_data={"key": "Y"}))
+        self.assertFalse(match(pattern, system_data={"key": "z"}))
+        self.assertTrue(match(pattern, system_data={"other": "z"}))
+        # Several literal patterns for the same value are merged into a set.
+        # Again, this must work for different flags and must not change the
+        # result.
+        pattern = (
+            "abc or def or @id_literal@GHI or @id_re@jkl or @id_literal@'m n' "
+            "or @data_literal:key@x or @data_literal:key@y"
+        )
+        for system_id in ["abc", "ABC", "Def", "GHI", "jkl", "m n"]:
+            self.assertTrue(match(pattern, system_id=system_id))
+            self.assertEqual(
+                [system_id], matcher(pattern).matches_many([system_id])
+            )
+        for system_id in ["ab", "ghi", "JKL", "m  n", "x", "\u212abc"]:
+            self.assertFalse(match(pattern, system_id=system_id))
+        self.assertTrue(match("k or l", system_id="\u212a"))
+        self.assertTrue(match(pattern, system_data={"key": "x"}))
+        self.assertTrue(match(pattern, system_data={"key": "y"}))
+        self.assertFalse(match(pattern, system_data={"key": "X"}))
+        self.assertEqual(
+            ["a", "b"],
+            matcher(pattern).matches_many(
+                ["a", "b"], system_data={"key": "y"}
+            ),
+        )
+
+    def test_compound_expression_deeply_nested(self):
+        """
+        Test that compound expressions work when the operators are nested
+        close to the maximum nesting depth.
+
+        Alternating ``and`` and ``or`` operators cannot be flattened when
+        simplifying the expression, so the compiled code has to be nested as
+        deeply as the expression.
+        """
+
+        def nested_expression(innermost):
+            # Each "and" has an operand that always matches and each "or" has
+            # an operand that never matches, so the result is the result of
+            # the innermost pattern.
+            expression = innermost
+            for index in range(98):
+                if index % 2:
+                    expression = f"(a* and {expression})"
+                else:
+                    expression = f"(z{index} or {expression})"
+            return expression
+
+        self.assertTrue(match(nested_expression("abc"), system_id="abc"))
+        self.assertFalse(match(nested_expression("def"), system_id="abc"))
+        self.assertEqual(
+            ["abc", "abd"],
+            matcher(nested_expression("ab?")).matches_many(
+                ["abc", "abd", "def"]
+            ),
+        )
+        # "not" followed by a parenthesized expression only counts as a
+        # single level of nesting.
+        expression = "abc"
+        for index in range(98):
+            expression = f"not (z{index} or {expression})"
+        self.assertTrue(match(expression, system_id="abc"))
+        self.assertFalse(match(expression, system_id="abd"))
+
+    def test_compound_expression_repeated_pattern(self):
+        """
+        Test that a pattern that appears more than once in a compound
+        expression is only evaluated once.
+        """
+
+        class CountingDict(dict):
+            """
+            Dictionary that counts how often `get` is called.
+            """
+
+            get_count = 0
+
+            def get(self, *args, **kwargs):
+                self.get_count += 1
+                return super().get(*args, **kwargs)
+
+        pattern = (
+            "(@data_re:key@'a.*' or x) and not (@data_re:key@'a.*' or y) "
+            "or @data_re:key@'a.*'"
+        )
+        system_data = CountingDict(key="abc")
+        self.assertTrue(match(pattern, system_id="z", system_data=system_data))
+        self.assertEqual(1, system_data.get_count)
+        system_data = CountingDict(key="def")
+        self.assertFalse(
+            match(pattern, system_id="z", system_data=system_data)
+        )
+        self.assertEqual(1, system_data.get_count)
+        system_data = CountingDict(key="def")
+        self.assertTrue(match(pattern, system_id="x", system_data=system_data))
+        # The pattern appears in both operands of the "and" expression, which
+        # are both evaluated in this case, but it is still only evaluated once.
+        self.assertEqual(1, system_data.get_count)
 
     def test_data_glob_expression(self):
         """
@@ -326,6 +489,18 @@ class TestMatch(unittest.TestCase):
                 system_data={"mykey": " {}()@*x"},
             )
         )
+        # When ignoring case, the same rules as for regular expressions should
+        # apply, even for characters that are not ASCII characters (the Kelvin
+        # sign is considered equal to “k”).
+        self.assertTrue(
+            match("@data_literal/i:key@abk", system_data={"key": "ABK"})
+        )
+        self.assertTrue(
+            match("@data_literal/i:key@abk", system_data={"key": "AB\u212a"})
+        )
+        self.assertFalse(
+            match("@data_literal:key@abk", system_data={"key": "AB\u212a"})
+        )
         # An unquoted comparions string must not contain special characters
         # (“@”, “(”, “)”, and whitespace).
         with self.assertRaises(ValueError):
@@ -431,6 +606,15 @@ class TestMatch(unittest.TestCase):
                 system_id="some-id",
             )
         )
+        # Wildcards at the start, at the end, or at both ends also match line
+        # breaks and ignoring case should work like for other patterns.
+        self.assertTrue(match("@id_glob@*-id", system_id="so\nme-id"))
+        self.assertTrue(match("@id_glob@some-*", system_id="some-\nid"))
+        self.assertTrue(match("@id_glob@**me-i*", system_id="\nsome-id\n"))
+        self.assertFalse(match("@id_glob@*me-i*", system_id="some-Id"))
+        self.assertTrue(match("@id_glob/i@*me-i*", system_id="some-Id"))
+        self.assertTrue(match("@id_glob/i@*-ik", system_id="some-I\u212a"))
+        self.assertFalse(match("@id_glob/i@*-ik", system_id="some-I\u212b"))
         # Patterns can be quoted (and must be quoted if they contain whitespace
         # or other special characters). Both double and single quotes can be
         # used.
@@ -498,6 +682,13 @@ class TestMatch(unittest.TestCase):
                 system_id=" {}()@*x",
             )
         )
+        # When ignoring case, the same rules as for regular expressions should
+        # apply, even for characters that are not ASCII characters (the Kelvin
+        # sign is considered equal to “k”).
+        self.assertTrue(match("@id_literal/i@abk", system_id="ABK"))
+        self.assertTrue(match("@id_literal/i@abk", system_id="AB\u212a"))
+        self.assertFalse(match("@id_literal/i@abk", system_id="AB\u212b"))
+        self.assertFalse(match("@id_literal@abk", system_id="AB\u212a"))
         # An unquoted comparions string must not contain special characters
         # (“@”, “(”, “)”, and whitespace).
         with self.assertRaises(ValueError):
@@ -524,6 +715,13 @@ class TestMatch(unittest.TestCase):
         # Most of the tests are the same as the ones for the id_literal
         # expressions.
         self._test_id_expression("id_re")
+        # Regular expressions without special characters only match the same
+        # string (ignoring case if requested).
+        self.assertTrue(match("@id_re@web-01", system_id="web-01"))
+        self.assertFalse(match("@id_re@web-01", system_id="web-011"))
+        self.assertFalse(match("@id_re@web-01", system_id="WEB-01"))
+        self.assertTrue(match("@id_re/i@web-01", system_id="WEB-01"))
+        self.assertTrue(match("@id_re/i@k", system_id="\u212a"))
         # Regular expressions may contain wildcards.
         self.assertTrue(
             match(
@@ -613,6 +811,19 @@ class TestMatch(unittest.TestCase):
             match("not")
         with self.assertRaises(ValueError):
             match("or")
+        # The position reported in the error message should refer to the
+        # complete expression, even if the error is inside a simple expression
+        # that is part of a compound expression.
+        with self.assertRaisesRegex(ValueError, "^Error at index 18 "):
+            match("a or @data_re:key@'('")
+        # Deeply nested expressions should result in a ValueError instead of a
+        # RecursionError, while reasonably nested expressions should work.
+        self.assertTrue(match("(" * 50 + "a" + ")" * 50, system_id="a"))
+        self.assertTrue(match("not " * 50 + "a", system_id="a"))
+        with self.assertRaisesRegex(ValueError, "nested more than"):
+            match("(" * 1000 + "a" + ")" * 1000)
+        with self.assertRaisesRegex(ValueError, "nested more than"):
+            match("not " * 1000 + "a")
 
     def test_operator_precedence(self):
         """
@@ -628,6 +839,39 @@ class TestMatch(unittest.TestCase):
         self.assertTrue(match("abc or (def and def)", system_id="abc"))
         self.assertFalse(match("(abc or def) and def", system_id="abc"))
 
+    def test_simplification(self):
+        """
+        Test that expressions that are simplified when being compiled (double
+        negations, patterns matching everything) still give the right results.
+        """
+        self.assertTrue(match("not not abc", system_id="abc"))
+        self.assertFalse(match("not not abc", system_id="def"))
+        self.assertFalse(match("not not not abc", system_id="abc"))
+        self.assertTrue(match("*", system_id=""))
+        self.assertTrue(match("** and abc", system_id="abc"))
+        self.assertFalse(match("* and abc", system_id="def"))
+        self.assertTrue(match("* or abc", system_id="def"))
+        self.assertFalse(match("not *", system_id="abc"))
+        self.assertTrue(match("not * or abc", system_id="abc"))
+        self.assertFalse(match("not (* or abc)", system_id="abc"))
+        self.assertTrue(match("not (not * and abc)", system_id="def"))
+        self.assertTrue(match("@data_glob:key@*"))
+        self.assertTrue(match("@data_glob:key@*", system_data={"key": 1}))
+        self.assertFalse(match("not @data_glob:key@*"))
+        # Patterns that look like they match everything, but that are not glob
+        # patterns must not be simplified.
+        self.assertTrue(match("@id_literal@*", system_id="*"))
+        self.assertFalse(match("@id_literal@*", system_id="abc"))
+        self.assertFalse(match("@id_re@.*", system_id="a\nb"))
+        self.assertEqual(
+            ["abc"],
+            matcher("not not * and abc").matches_many(["abc", "def"]),
+        )
+        self.assertEqual(
+            [],
+            matcher("not * and abc").matches_many(["abc", "def"]),
+        )
+
     def test_unqualified_pattern(self):
         """
         Test pattern expressions that do not explicitly specify a type.
@@ -680,6 +924,8 @@ class TestMatcher(unittest.TestCase):
         could get lost if the paremeter is not passed on.
         """
         m = matcher("abc")
+        # Matchers are cached, so we should get the same object again.
+        self.assertIs(m, matcher("abc"))
         self.assertTrue(m.matches(system_id="aBc"))
         self.assertFalse(m.matches(system_id="def"))
         self.assertTrue(m.matches(system_id="abc"))
@@ -694,3 +940,39 @@ class TestMatcher(unittest.TestCase):
         self.assertTrue(m.matches(system_id="aBc"))
         self.assertFalse(m.matches(system_id="Abc"))
         self.assertFalse(m.matches(system_id="abc"))
+
+    def test_matches_many(self):
+        """
+        Test the ``matches_many`` method. It should give the same result as
+        calling ``matches`` for each system ID.
+        """
+        system_ids = ["abc", "ABC", "abd", "def", "", "xyz"]
+        for expression_str in [
+            "abc",
+            "@id_glob@abc",
+            "@id_literal@abc",
+            "@id_re/i@ab.",
+            "ab* or @id_literal@def",
+            "not ab*",
+            "@data_glob:key@v*",
+            "@data_literal:key@x",
+            "not @data_literal:key@x",
+            "ab* and @data_glob:key@v*",
+        ]:
+            m = matcher(expression_str)
+            for system_data in [None, {"key": "value"}]:
+                self.assertEqual(
+                    [
+                        system_id
+                        for system_id in system_ids
+                        if m.matches(
+                            system_id=system_id, system_data=system_data
+                        )
+                    ],
+                    m.matches_many(system_ids, system_data=system_data),
+                )
+        # Any iterable should be accepted.
+        self.assertEqual(
+            ["abc", "abd"],
+            matcher("@id_glob@ab*").matches_many(iter(system_ids)),
+        )
@@ -21,11 +21,57 @@ single `DataStore` instance may be shared by different threads.
 A `DataStore` instance is created by calling `open_data_store`.
 """
 
+import contextlib
 import json
 import sqlite3
 import threading
 
-from typing import Any, Mapping, Sequence
+from typing import Any, Iterator, Mapping, Sequence, Tuple
+
+# The encoders produce exactly the same JSON text as json.dumps with its
+# default settings. The same database file may be used by older versions of
+# this module, which look up values using that representation, so it must not
+# be changed. Escaping non-ASCII characters also ensures that strings
+# containing lone surrogates can be stored.
+#
+# When strict value checking is enabled, _check_value already detects circular
+# references, so the encoder does not have to check for them again. When it is
+# disabled, we have to rely on the encoder for detecting them.
+_dumps_checked = json.JSONEncoder(check_circular=False).encode
+_dumps_unchecked = json.JSONEncoder().encode
+# json.loads performs a few checks on its argument before delegating to the
+# default decoder. The values that we read from the database are always valid
+# str objects, so we can call the decoder directly.
+_loads = json.JSONDecoder().decode
+
+# Marker used by DataStore._check_value.
+_END_OF_CONTAINER = object()
+
+# Number of rows that DataStore._iter_rows fetches while holding the lock.
+_ITER_BATCH_SIZE = 64
+
+# SQL statements used by DataStore. The sqlite3 module keeps a cache of
+# prepared statements for each connection (see the cached_statements parameter
+# of sqlite3.connect), so these statements are only parsed once per
+# connection. Keeping them in one place makes it easy to verify that their
+# number stays well below the default size of that cache (128 statements).
+_SQL_DELETE_DATA = "DELETE FROM system_data WHERE system_id=?;"
+_SQL_DELETE_VALUE = "DELETE FROM system_data WHERE system_id=? and key=?;"
+_SQL_FIND_SYSTEMS = (
+    "SELECT system_id FROM system_data WHERE key=? AND value=? "
+    "ORDER BY system_id;"
+)
+_SQL_GET_DATA = (
+    "SELECT key, value FROM system_data WHERE system_id=? ORDER BY key;"
+)
+_SQL_GET_VALUE = "SELECT value FROM system_data WHERE system_id=? AND KEY=?;"
+_SQL_LIST_SYSTEMS = (
+    "SELECT DISTINCT system_id FROM system_data ORDER BY system_id;"
+)
+_SQL_SET_VALUE = (
+    "INSERT OR REPLACE INTO system_data (system_id, key, value) VALUES "
+    "(?, ?, ?);"
+)
 
 
 class DataStore:
@@ -73,13 +119,34 @@ class DataStore:
         # either, so we have to assume that SQLite is not thread safe, even
         # though on most systems it probably is. This means that we protect
         # access to the connection with our own mutex.
+        # All threads share this mutex, so it should be held as briefly as
+        # possible. Methods only hold it while executing a statement and
+        # fetching the resulting rows. Values are encoded before acquiring it
+        # and decoded after releasing it. The iter_* methods fetch the rows in
+        # batches and only hold the mutex while fetching a batch.
         self._strict_value_checking = strict_value_checking
         self._connection = sqlite3.connect(
-            db_file, isolation_level=None, check_same_thread=False
+            db_file,
+            check_same_thread=False,
+            isolation_level=None,
         )
         self._lock = threading.Lock()
         self._create_tables()
 
+    def analyze(self) -> None:
+        """
+        Update the statistics that the database uses for planning queries.
+
+        This should be called after a large number of values has been inserted
+        or removed, so that the database can choose the most efficient way of
+        running queries (e.g. for `find_systems`). Statistics are also updated
+        (if needed) when the data store is closed, so calling this method is
+        only necessary when the data store is going to be used for a long time
+        after making such changes.
+        """
+        with self._lock:
+            self._connection.execute("ANALYZE;")
+
     def close(self) -> None:
         """
         Close this data store. This closes the underlying database connection.
@@ -91,6 +158,15 @@ class DataStore:
         raised.
         """
         with self._lock:
+            # SQLite recommends running this pragma before closing a
+            # connection. It only updates statistics when the queries that
+            # have been run on this connection would benefit from it. Failing
+            # to do so (e.g. because the database file is read-only) is not a
+            # reason to fail closing the connection.
+            try:
+                self._connection.execute("PRAGMA optimize;")
+            except sqlite3.Error:
+                pass
             self._connection.close()
 
     def delete_data(self, system_id: str) -> None:
@@ -101,9 +177,7 @@ class DataStore:
             system_id for which all data (all keys) shall be deleted.
         """
         with self._lock:
-            self._connection.execute(
-                "DELETE FROM system_data WHERE system_id=?;", (system_id,)
-            )
+            self._connection.execute(_SQL_DELETE_DATA, (system_id,))
 
     def delete_value(self, system_id: str, key: str) -> None:
         """
@@ -117,10 +191,7 @@ class DataStore:
             affected by this operation.
         """
         with self._lock:
-            self._connection.execute(
-                "DELETE FROM system_data WHERE system_id=? and key=?;",
-                (system_id, key),
-            )
+            self._connection.execute(_SQL_DELETE_VALUE, (system_id, key))
 
     def find_systems(self, key: str, value: Any) -> Sequence:
         """
@@ -138,17 +209,11 @@ class DataStore:
         :return:
             list of system IDs that match the predicate.
         """
+        json_value = _dumps_unchecked(value)
         with self._lock:
-            cursor = self._connection.execute(
-                "SELECT system_id FROM system_data WHERE key=? AND value=? "
-                "ORDER BY system_id;",
-                (key, json.dumps(value)),
-            )
-            try:
-                cursor.arraysize = 16
-                rows = cursor.fetchall()
-            finally:
-                cursor.close()
+            rows = self._connection.execute(
+                _SQL_FIND_SYSTEMS, (key, json_value)
+            ).fetchall()
         systems = [row[0] for row in rows]
         return systems
 
@@ -169,17 +234,10 @@ class DataStore:
             dictionary containing all data for the specified system ID.
         """
         with self._lock:
-            cursor = self._connection.execute(
-                "SELECT key, value FROM system_data WHERE system_id=? ORDER "
-                "BY key;",
-                (system_id,),
-            )
-            try:
-                cursor.arraysize = 16
-                rows = cursor.fetchall()
-            finally:
-                cursor.close()
-        data = {row[0]: json.loads(row[1]) for row in rows}
+            rows = self._connection.execute(
+                _SQL_GET_DATA, (system_id,)
+            ).fetchall()
+        data = {row[0]: _loads(row[1]) for row in rows}
         return data
 
     def get_value(self, system_id: str, key: str) -> Any:
@@ -197,19 +255,85 @@ class DataStore:
         :return:
             value associated with the specified system ID and key.
         """
+        with self._lock:
+            row = self._connection.execute(
+                _SQL_GET_VALUE, (system_id, key)
+            ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return _loads(row[0])
+
+    @contextlib.contextmanager
+    def iter_data(self, system_id: str) -> Iterator[Iterator[Tuple[str, Any]]]:
+        """
+        Iterate over all data associated with a specific system ID.
+
+        This is similar to `get_data`, but instead of building a ``dict``, the
+        key value pairs are read from the database while iterating over them.
+        This reduces the memory consumption when a system has a lot of data
+        and the caller only has to look at each item once.
+
+        This method returns a context manager that provides the iterator. The
+        iterator must only be used inside the ``with`` block::
+
+            with data_store.iter_data('system_id') as items:
+                for key, value in items:
+                    print(key, value)
+
+        The rows are fetched in small batches and this data store is only
+        locked while fetching a batch, so the code inside the ``with`` block
+        may call other methods of this data store. However, if the data of the
+        system is modified while iterating over it, it is undefined whether
+        the iterator reflects these modifications.
+
+        :param system_id:
+            system ID of the system for which the data shall be retrieved.
+        :return:
+            context manager that provides an iterator over ``(key, value)``
+            tuples, sorted by key.
+        """
+        with self._lock:
+            cursor = self._connection.execute(_SQL_GET_DATA, (system_id,))
+        try:
+            yield ((row[0], _loads(row[1])) for row in self._iter_rows(cursor))
+        finally:
+            with self._lock:
+                cursor.close()
+
+    @contextlib.contextmanager
+    def iter_find_systems(
+        self, key: str, value: Any
+    ) -> Iterator[Iterator[str]]:
+        """
+        Iterate over the system IDs associated with a certain key value pair.
+
+        This is similar to `find_systems`, but instead of building a list, the
+        system IDs are read from the database while iterating over them. This
+        allows the caller to stop early (e.g. after finding more than one
+        system) without reading all matching rows.
+
+        Like `iter_data`, this method returns a context manager that provides
+        the iterator. Please refer to the documentation of `iter_data` for
+        details.
+
+        :param key:
+            key that shall be tested.
+        :param value:
+            data that is expected for the specified key.
+        :return:
+            context manager that provides an iterator over the matching system
+            IDs, sorted by system ID.
+        """
+        json_value = _dumps_unchecked(value)
         with self._lock:
             cursor = self._connection.execute(
-                "SELECT value FROM system_data WHERE system_id=? AND "
-                "KEY=?;",
-                (system_id, key),
+                _SQL_FIND_SYSTEMS, (key, json_value)
             )
-            try:
-                row = cursor.fetchone()
-            finally:
+        try:
+            yield (row[0] for row in self._iter_rows(cursor))
+        finally:
+            with self._lock:
                 cursor.close()
-        if row is None:
-            raise KeyError(key)
-        return json.loads(row[0])
 
     def list_systems(self) -> Sequence[str]:
         """
@@ -222,15 +346,7 @@ class DataStore:
             list of system IDs that are known by this data store.
         """
         with self._lock:
-            cursor = self._connection.execute(
-                "SELECT DISTINCT system_id FROM system_data "
-                "ORDER BY system_id;"
-            )
-            try:
-                cursor.arraysize = 16
-                rows = cursor.fetchall()
-            finally:
-                cursor.close()
+            rows = self._connection.execute(_SQL_LIST_SYSTEMS).fetchall()
         systems = [row[0] for row in rows]
         return systems
 
@@ -281,64 +397,97 @@ class DataStore:
         """
         if self._strict_value_checking:
             self._check_value(value)
-        json_value = json.dumps(value)
+            json_value = _dumps_checked(value)
+        else:
+            json_value = _dumps_unchecked(value)
         with self._lock:
             self._connection.execute(
-                "INSERT OR REPLACE INTO system_data (system_id, key, value) "
-                "VALUES (?, ?, ?);",
-                (system_id, key, json_value),
+                _SQL_SET_VALUE, (system_id, key, json_value)
             )
 
-    def _check_value(self, value, parents=None):
-        if value is None:
-            return
-        if parents is None:
-            parents = []
-        if isinstance(value, (bool, float, int, str)):
-            return
-        # Before checking dicts and lists, we have to ensure that there is no
-        # reference loop, otherwise the checks would continue until we run out
-        # of stack space.
-        for parent_val in parents:
-            if parent_val is value:
+    def _check_value(self, value):
+        # We use an explicit stack instead of recursion. This way, we do not
+        # need a new list of parents for each level and deeply nested values
+        # cannot exhaust the Python stack. Before descending into a dict or a
+        # list, we push its ID followed by _END_OF_CONTAINER onto the stack, so
+        # that we know when to remove it from the set of ancestors again.
+        ancestors = set()
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            if value is _END_OF_CONTAINER:
+                ancestors.remove(stack.pop())
+                continue
+            if value is None or isinstance(value, (bool, float, int, str)):
+                continue
+            # Before checking dicts and lists, we have to ensure that there is
+            # no reference loop, otherwise the checks would never end. Please
+            # note that the same object may be referenced multiple times, as
+            # long as it is not its own ancestor.
+            value_id = id(value)
+            if value_id in ancestors:
                 raise ValueError("Circular reference detected.")
-        if isinstance(value, dict):
-            for key, dict_val in value.items():
-                if not isinstance(key, str):
-                    raise TypeError(
-                        f"Object of type {type(key).__name__} is not strictly "
-                        "JSON serializable when used as the key of a dict."
-                    )
-                self._check_value(dict_val, parents + [value])
-            return
-        if isinstance(value, list):
-            for list_val in value:
-                self._check_value(list_val, parents + [value])
-            return
-        raise TypeError(
-            f"Object of type {type(value).__name__} is not strictly JSON "
-            "serializable."
-        )
+            if isinstance(value, dict):
+                for key in value:
+                    if not isinstance(key, str):
+                        raise TypeError(
+                            f"Object of type {type(key).__name__} is not "
+                            "strictly JSON serializable when used as the key "
+                            "of a dict."
+                        )
+                children = value.values()
+            elif isinstance(value, list):
+                children = value
+            else:
+                raise TypeError(
+                    f"Object of type {type(value).__name__} is not strictly "
+                    "JSON serializable."
+                )
+            ancestors.add(value_id)
+            stack.append(value_id)
+            stack.append(_END_OF_CONTAINER)
+            stack.extend(children)
 
     def _create_tables(self):
-        # We store the data in a single table. In addition to the implicit
-        # index that is created on the primary key, we create an index that
-        # allows us to quickly find all rows for a certain systen and an index
-        # that allows us to quickly find all rows with certain key value pairs.
+        # We store the data in a single table. The implicit index that is
+        # created on the primary key allows us to quickly find all rows for a
+        # certain system. In addition to that, we create an index that allows
+        # us to quickly find all rows with certain key value pairs. As the
+        # table does not have a row ID, this index also contains the columns
+        # of the primary key, so it can answer find_systems queries on its
+        # own.
+        # Older versions also created a separate index on the system_id
+        # column. This index is redundant (lookups by system ID use the
+        # primary key), so we remove it in order to make writes cheaper.
+        # The same database file may be used by several processes, which might
+        # run different versions of this code, so the table layout and the
+        # storage format of the values (JSON text) must not be changed in an
+        # incompatible way. Indexes do not affect compatibility, so an older
+        # version recreating the index does not cause any problems.
         with self._lock:
-            self._connection.executescript(
-                """
+            self._connection.executescript("""
                 CREATE TABLE IF NOT EXISTS system_data (
                     system_id TEXT NOT NULL,
                     key TEXT NOT NULL,
                     value TEXT NOT NULL,
                     PRIMARY KEY (system_id, key)) WITHOUT ROWID;
-                CREATE INDEX IF NOT EXISTS system_id_index
-                    ON system_data (system_id);
+                DROP INDEX IF EXISTS system_id_index;
                 CREATE INDEX IF NOT EXISTS key_value_index
                     ON system_data (key, value);
-                """
-            )
+                """)
+
+    def _iter_rows(self, cursor: sqlite3.Cursor) -> Iterator[Tuple]:
+        # Fetching the rows in batches means that we do not have to hold the
+        # lock while the caller processes them. This way, other threads are
+        # not blocked for long and the caller may use other methods of this
+        # data store (which would otherwise deadlock because the lock is not
+        # reentrant).
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(_ITER_BATCH_SIZE)
+            if not rows:
+                return
+            yield from rows
 
     def __enter__(self):
         # We do not have to do anything here because we already opened the
@@ -371,6 +520,10 @@ def open_data_store(db_file: str, strict_value_checking=True) -> DataStore:
     simplify resource management. Please refer to the class documentation of
     `DataStore` for an example.
 
+    After inserting or removing a large number of values, the
+    `~DataStore.analyze` method can be called in order to update the statistics
+    that are used for planning database queries.
+
     :param db_file:
         path to the database file that stores the catual data.
     :param strict_value_checking:
@@ -7,7 +7,12 @@ data sources (depending on the context in which the expression is evaluated).
 A system ID can be matched against an expression using the `match` function. If
 the same expression is used repeatedly, a `Matcher` can be retrieved using the
 `matcher` function. However, even the `match` function implements a simple
-cache in order to avoid recompiling frequently used expressions.
+cache in order to avoid recompiling frequently used expressions. Statistics
+about this cache can be retrieved through the `cache_info` function. Code that
+knows the expressions that are going to be used in advance (e.g. because they
+are specified in a configuration file) can add them to this cache through the
+`precompile` function, so that the first match does not have to pay the cost
+of compiling the expression.
 
 Expressions understood by this module are combinations of four different
 subexpressions:
@@ -234,12 +239,28 @@ Examples:
 * ``@id_re/i@'ID with special characters like the quotation mark \\', the
   backslash \\\\\\\\, the @ character, and parentheses \\\\(\\\\)'``
 """
+
 import functools
+import itertools
+import types
 
-from typing import Optional
+from typing import Iterable, List, Optional, Tuple
 
-from ._parser.base import Expression, ParseError
+from ._parser.base import Expression, ManyExpression, ParseError
 from ._parser.compound_expr import CompoundExpressionParser
+from ._parser.tree import Node
+
+# Maximum number of expressions that are kept in the cache. Compiled
+# expressions only use a few kilobytes of memory, so we can afford a cache that
+# is large enough for all expressions used by a typical configuration, even if
+# there are many systems and many different expressions.
+_CACHE_SIZE = 4096
+
+# Empty system data that is used when no system data is specified. Using the
+# same object for all calls avoids creating a new dict each time. The
+# expressions never modify the system data, but we still use a read-only view,
+# so that the shared object cannot be modified accidentally.
+_EMPTY_SYSTEM_DATA = types.MappingProxyType({})
 
 
 class Matcher:
@@ -262,6 +283,9 @@ class Matcher:
         """
         self._expression = _expression_from_string_cached(expression_str)
         self._expression_str = expression_str
+        # The expression for matching many system IDs is only compiled when it
+        # is needed for the first time.
+        self._many_expression: Optional[ManyExpression] = None
 
     def matches(
         self,
@@ -285,16 +309,86 @@ class Matcher:
             ``True`` if the expression represented by this matcher matches the
             specified system ID and system data, ``False`` otherwise.
         """
-        if system_id is None:
-            system_id = ""
+        return self._expression(
+            system_id if system_id is not None else "",
+            system_data if system_data is not None else _EMPTY_SYSTEM_DATA,
+        )
+
+    def matches_many(
+        self,
+        system_ids: Iterable[str],
+        /,
+        *,
+        system_data: Optional[dict] = None,
+    ) -> List[str]:
+        """
+        Return the system IDs that are matched by this matcher.
+
+        This gives the same result as calling `matches` for each of the system
+        IDs. When the expression is a single pattern (possibly negated with
+        ``not``), the pattern is tested for all system IDs in one loop that
+        runs in C code, which is faster than calling `matches` for each of
+        them. Expressions that use ``and`` or ``or`` are still evaluated
+        separately for each system ID, so for them this method only saves the
+        overhead of calling `matches`.
+
+        :param system_ids:
+            system IDs to be matched against the expression.
+        :param system_data:
+            system data to be matched against the expression. The same system
+            data is used for all system IDs. If ``None`` this is treated like
+            an empty dict.
+
+        :return:
+            list of the system IDs from ``system_ids`` that are matched by the
+            expression represented by this matcher. The order of the system
+            IDs is preserved.
+        """
+        if not isinstance(system_ids, (list, tuple)):
+            system_ids = list(system_ids)
         if system_data is None:
-            system_data = {}
-        return self._expression(system_id, system_data)
+            system_data = _EMPTY_SYSTEM_DATA
+        many_expression = self._many_expression
+        if many_expression is None:
+            many_expression = _node_from_string_cached(
+                self._expression_str
+            ).compile_many()
+            self._many_expression = many_expression
+        return list(
+            itertools.compress(
+                system_ids, many_expression(system_ids, system_data)
+            )
+        )
 
     def __str__(self):
         return self._expression_str
 
 
+def cache_clear() -> None:
+    """
+    Clear the cache of compiled expressions and matchers.
+
+    This does not affect `Matcher` objects that have already been returned.
+    """
+    _expression_from_string_cached.cache_clear()
+    _matcher_cached.cache_clear()
+    _node_from_string_cached.cache_clear()
+
+
+def cache_info() -> Tuple[int, int, Optional[int], int]:
+    """
+    Return statistics about the cache of compiled expressions.
+
+    This can be used to check whether the cache is effective for a certain
+    workload.
+
+    :return:
+        named tuple with the fields ``hits``, ``misses``, ``maxsize``, and
+        ``currsize`` (see `functools.lru_cache`).
+    """
+    return _expression_from_string_cached.cache_info()
+
+
 def match(
     expression_str: str,
     /,
@@ -333,12 +427,10 @@ def match(
     :raise ValueError:
         if the expression is invalid and cannot be compiled.
     """
-    expression = _expression_from_string_cached(expression_str)
-    if system_id is None:
-        system_id = ""
-    if system_data is None:
-        system_data = {}
-    return expression(system_id, system_data)
+    return _expression_from_string_cached(expression_str)(
+        system_id if system_id is not None else "",
+        system_data if system_data is not None else _EMPTY_SYSTEM_DATA,
+    )
 
 
 def matcher(expression_str: str, /) -> Matcher:
@@ -348,8 +440,9 @@ def matcher(expression_str: str, /) -> Matcher:
     Raises an exception if ``expression_str`` is not a valid matcher expression
     supported by this module.
 
-    This function internally keeps a cache of compiled expressions in order to
-    reduce the overhead when the same expression is used repeatedly. However,
+    This function internally keeps a cache of matchers in order to reduce the
+    overhead when the same expression is used repeatedly, so calling it twice
+    with the same expression typically returns the same matcher. However,
     calling code is still encouraged to keep a reference to the returned
     matcher when it knows that the same expression is going to be used
     repeatedly.
@@ -365,20 +458,67 @@ def matcher(expression_str: str, /) -> Matcher:
     :raise ValueError:
         if the expression is invalid and cannot be compiled.
     """
-    return Matcher(expression_str)
+    return _matcher_cached(expression_str)
+
+
+def precompile(expression_strs: Iterable[str], /) -> None:
+    """
+    Compile the specified expressions and add them to the cache.
+
+    Subsequent calls to `match` and `matcher` for these expressions are served
+    from the cache, so they do not have to parse and compile the expression.
+    The cache is bounded, so an expression might still be evicted from it if
+    a lot of other expressions are used later.
+
+    :param expression_strs:
+        expressions to be compiled. Please refer to the
+        `module documentation <vinegar.utils.system_matcher>` for details about
+        the expression format.
+
+    :raise ValueError:
+        if one of the expressions is invalid and cannot be compiled.
+    """
+    for expression_str in expression_strs:
+        # Creating the matcher also compiles the expression and adds it to the
+        # cache used by match.
+        _matcher_cached(expression_str)
 
 
-@functools.lru_cache(maxsize=256, typed=True)
+@functools.lru_cache(maxsize=_CACHE_SIZE, typed=True)
 def _expression_from_string_cached(expression_str: str) -> Expression:
     """
     Call `_expression_from_string` but cache the result.
 
     This is used by `match` for performance reasons.
     """
+    return _node_from_string_cached(expression_str).compile()
+
+
+@functools.lru_cache(maxsize=_CACHE_SIZE, typed=True)
+def _matcher_cached(expression_str: str) -> Matcher:
+    """
+    Create a `Matcher` and cache the result.
+
+    Matchers are immutable, so the same matcher can be shared by all callers.
+    This is used by `matcher` for performance reasons.
+    """
+    return Matcher(expression_str)
+
+
+@functools.lru_cache(maxsize=_CACHE_SIZE, typed=True)
+def _node_from_string_cached(expression_str: str) -> Node:
+    """
+    Parse an expression into a syntax tree and cache the result.
+
+    The syntax tree is immutable, so it can be shared by all callers. It is
+    simplified before it is returned, so that it is as cheap to evaluate as
+    possible.
+    """
     try:
-        return CompoundExpressionParser(expression_str).parse()
+        node = CompoundExpressionParser(expression_str).parse()
     except ParseError as err:
         raise ValueError(
             f"Error at index {err.position} while parsing matcher expression "
             f"{expression_str!r}: {str(err)}"
         ) from err
+    return node.simplify()
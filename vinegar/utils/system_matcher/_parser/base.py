@@ -15,6 +15,20 @@ If the expression matches the provided information ``True`` is returned,
 otherwise ``False`` is returned.
 """
 
+ManyExpression = typing.Callable[
+    [typing.Sequence[str], dict], typing.List[bool]
+]
+"""
+Type alias for a function representing an expression that is evaluated for
+many system IDs at once.
+
+The first argument is a sequence of system IDs and the second argument is the
+system data that is used for all of them.
+
+A list is returned that contains ``True`` for each system ID for which the
+expression matches and ``False`` for each system ID for which it does not.
+"""
+
 
 class ParseError(ValueError):
     """
@@ -37,18 +51,28 @@ class ParserBase:
     parser, but it is not useful on its own.
     """
 
-    def __init__(self, input_str: str, /):
+    __slots__ = ("_input_len", "_input_str", "_position")
+
+    def __init__(self, input_str: str, /, position: int = 0):
         """
         Create a parser object for the specified string.
 
         :param input_str:
             string that is the input for the parsing process.
+        :param position:
+            position in ``input_str`` at which the parsing process starts. This
+            allows a parser to delegate parsing a part of its input to another
+            parser without having to copy the remaining input.
         """
         self._input_str: str = input_str
         """
         Input string being parsed.
         """
-        self._position: int = 0
+        self._input_len: int = len(input_str)
+        """
+        Length of the input string.
+        """
+        self._position: int = position
         """
         Current position of the parsing process.
 
@@ -70,7 +94,9 @@ class ParserBase:
             ``True`` if the specified string was found at the current position,
             ``False`` otherwise.
         """
-        if self._input_str[self._position :].startswith(accepted_str):
+        # Passing the start position to startswith() avoids copying the
+        # remaining input string.
+        if self._input_str.startswith(accepted_str, self._position):
             self._position += len(accepted_str)
             return True
         return False
@@ -133,10 +159,10 @@ class ParserBase:
             excerpt of the remaining string, ready for inclusion in error or
             similar messages.
         """
-        if self._position == len(self._input_str):
+        if self._position == self._input_len:
             return "end-of-string"
         if (max_length < 0) or (
-            self._position + max_length >= len(self._input_str)
+            self._position + max_length >= self._input_len
         ):
             return repr(self._input_str[self._position :])
         excerpt = self._input_str[self._position : self._position + max_length]
@@ -240,7 +266,7 @@ class ParserBase:
             string starting at the current position.
         """
         if (max_length < 0) or (
-            self._position + max_length >= len(self._input_str)
+            self._position + max_length >= self._input_len
         ):
             return self._input_str[self._position :]
         return self._input_str[self._position : self._position + max_length]
@@ -258,10 +284,10 @@ class ParserBase:
         """
         if length < 0:
             raise IndexError("Length must not be negative.")
-        if self._position + length > len(self._input_str):
+        if self._position + length > self._input_len:
             raise IndexError(
                 f"Cannot skip {length} characters when only "
-                f"{len(self._input_str) - self._position} are remaining."
+                f"{self._input_len - self._position} are remaining."
             )
         self._position += length
 
@@ -277,7 +303,17 @@ class ParserBase:
         """
         Has the parsing process reached the end of the string?
         """
-        return self._position == len(self._input_str)
+        return self._position == self._input_len
+
+    @property
+    def position(self) -> int:
+        """
+        Current position of the parsing process.
+
+        All characters before that position have already been handled by the
+        parsing process.
+        """
+        return self._position
 
     @property
     def remaining_input(self) -> str:
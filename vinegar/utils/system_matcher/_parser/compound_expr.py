@@ -2,64 +2,51 @@
 Parser for a compound expression.
 """
 
+import functools
+import re
 import typing
 
-from .base import Expression, ParseError, ParserBase
+from .base import ParseError, ParserBase
 from .simple_expr import SimpleExpressionParser
+from .tree import AndNode, Node, NotNode, OrNode
 
+# The parser calls itself recursively for each parenthesized expression and
+# each “not” keyword. We limit how deeply these may be nested, so that such
+# an expression results in a ParseError instead of a RecursionError. A “not”
+# that is directly followed by a parenthesized expression only counts as one
+# level. The limit is far above anything that is needed in practice. The
+# nesting depth of the code generated for an expression is limited separately
+# (see tree._MAX_SOURCE_DEPTH), so any expression accepted here can be
+# compiled.
+_MAX_NESTING_DEPTH = 100
 
-def _and_expression(
-    left_expression: Expression, right_expression: Expression
-) -> Expression:
-    """
-    Return an ``and`` expression. This is an expression that evaluates to
-    ``True`` if both its left and right expression evaluate to ``True``.
-    """
-
-    def evaluate(system_id: str, system_data: dict) -> bool:
-        # If the left expression evaluates to False, we can skip the evaluation
-        # of the right expression.
-        if not left_expression(system_id, system_data):
-            return False
-        return right_expression(system_id, system_data)
-
-    return evaluate
-
-
-def _not_expression(expression: Expression) -> Expression:
-    """
-    Return a ``not`` expression. This is an expression that negates its
-    sub-expression.
-    """
-
-    def evaluate(system_id: str, system_data: dict) -> bool:
-        return not expression(system_id, system_data)
+# Regular expression matching a string that contains neither whitespace nor
+# parentheses.
+_NO_SEPARATOR_REGEXP = re.compile(r"[^\s()]*")
 
-    return evaluate
+# Regular expression matching a (possibly empty) run of whitespace. The \s
+# class uses the same definition of whitespace as str.isspace().
+_WHITESPACE_REGEXP = re.compile(r"\s*")
 
 
-def _or_expression(
-    left_expression: Expression, right_expression: Expression
-) -> Expression:
+class CompoundExpressionParser(ParserBase):
     """
-    Return an ``or`` expression. This is an expression that evaluates to
-    ``True`` if either its left or its right expression evaluate to ``True``.
+    Parser for a compound matching expression.
     """
 
-    def evaluate(system_id: str, system_data: dict) -> bool:
-        # If the left expression evaluates to True, we can skip the evaluation
-        # of the right expression.
-        if left_expression(system_id, system_data):
-            return True
-        return right_expression(system_id, system_data)
-
-    return evaluate
+    __slots__ = ("_nesting_depth",)
 
+    def __init__(self, input_str: str, /, position: int = 0):
+        """
+        Create a parser object for the specified string.
 
-class CompoundExpressionParser(ParserBase):
-    """
-    Parser for a compound matching expression.
-    """
+        :param input_str:
+            string that is the input for the parsing process.
+        :param position:
+            position in ``input_str`` at which the parsing process starts.
+        """
+        super().__init__(input_str, position)
+        self._nesting_depth = 0
 
     def _accept_keyword(
         self, accepted_keywords: typing.Sequence[str] = ("and", "not", "or")
@@ -91,6 +78,46 @@ class CompoundExpressionParser(ParserBase):
             self._skip(len(keyword))
         return keyword
 
+    def _accept_single_simple_expression(self) -> typing.Optional[Node]:
+        """
+        Consume and return a simple expression that extends up to the end of
+        the string.
+
+        Most expressions consist of a single simple expression (e.g.
+        ``*.example.com``). For these, the result is the same as when parsing
+        them through the full grammar, but less work is needed.
+
+        If the remaining input is not a single simple expression, nothing is
+        consumed. In this case, the input has to be parsed through the full
+        grammar, which also results in the proper error message if the input
+        is invalid.
+
+        :return:
+            consumed expression or ``None`` if the remaining input is not a
+            single simple expression.
+        """
+        # Operators are always separated from their operands by whitespace or
+        # parentheses, so if there is neither, there cannot be an operator.
+        # Quoted patterns may contain these characters, but such expressions
+        # are rare enough that we can simply parse them through the full
+        # grammar. A keyword on its own is not a valid expression, but the
+        # simple expression parser would treat it as a pattern.
+        if not _NO_SEPARATOR_REGEXP.fullmatch(
+            self._input_str, self._position
+        ) or _keyword_regexp(("and", "not", "or")).match(
+            self._input_str, self._position
+        ):
+            return None
+        parser = SimpleExpressionParser(self._input_str, self._position)
+        try:
+            node = parser.parse(ignore_extra_input=True)
+        except ParseError:
+            return None
+        if not parser.end_of_string:
+            return None
+        self._position = parser.position
+        return node
+
     def _accept_whitespace(self) -> str:
         """
         Consume and return whitespace.
@@ -103,17 +130,14 @@ class CompoundExpressionParser(ParserBase):
             consumed whitespace or the empty string if the character at the
             current position does not represent whitespace.
         """
-        whitespace = ""
-        while self._peek(1).isspace():
-            char = self._accept_any_char()
-            # isspace() is False for the empty string, so there must be at
-            # least one remaining character, which means that
-            # _accept_any_char() cannot return None.
-            assert char is not None
-            whitespace += char
-        return whitespace
-
-    def _expect_compound_and_expression(self) -> Expression:
+        match = _WHITESPACE_REGEXP.match(self._input_str, self._position)
+        # The regular expression also matches the empty string, so there
+        # always is a match.
+        assert match is not None
+        self._position = match.end()
+        return match.group()
+
+    def _expect_compound_and_expression(self) -> Node:
         """
         Consume and return a compound ``and`` expression.
 
@@ -129,10 +153,10 @@ class CompoundExpressionParser(ParserBase):
         # parantheses are used, which make the “or” expression a unary
         # expression).
         return self._expect_generic_compound_expression(
-            "and", self._expect_unary_expression, _and_expression
+            "and", self._expect_unary_expression, AndNode
         )
 
-    def _expect_compound_or_expression(self) -> Expression:
+    def _expect_compound_or_expression(self) -> Node:
         """
         Consume and return a compound ``or`` expression.
 
@@ -147,17 +171,15 @@ class CompoundExpressionParser(ParserBase):
         # proces all consecutive “and” expressions before we may create an “or”
         # expression.
         return self._expect_generic_compound_expression(
-            "or", self._expect_compound_and_expression, _or_expression
+            "or", self._expect_compound_and_expression, OrNode
         )
 
     def _expect_generic_compound_expression(
         self,
         keyword: str,
-        expect_subexpression: typing.Callable[[], Expression],
-        reduce_expressions: typing.Callable[
-            [Expression, Expression], Expression
-        ],
-    ) -> Expression:
+        expect_subexpression: typing.Callable[[], Node],
+        node_type: typing.Union[typing.Type[AndNode], typing.Type[OrNode]],
+    ) -> Node:
         """
         Base function for parsing compound expressions.
 
@@ -172,13 +194,12 @@ class CompoundExpressionParser(ParserBase):
             function that is called to parse each subexpression. This method
             must consume the input for the subexpression and return the
             respective expression.
-        :param reduce_expressions:
-            function that is called to combine subexpressions. Each time the
-            keyword is encountered, this function is called with the expression
-            left to the keyword and the expression immediately right to the
-            keyword. For the second and subsequent keywords, the expression
-            left to the keyword is the one that was the result of the previous
-            call to this function.
+        :param node_type:
+            type of the node that is created to combine the subexpressions if
+            there is more than one of them. Subexpressions that are nodes of
+            the same type (because they were wrapped in parentheses) are
+            flattened, so that their operands become operands of the combined
+            node.
 
         :return:
             consumed expression.
@@ -187,34 +208,39 @@ class CompoundExpressionParser(ParserBase):
         # discarded.
         self._accept_whitespace()
         # We get the first subexpression, which must always be present.
-        left_expression = expect_subexpression()
+        operands = [expect_subexpression()]
         # Before the next keyword and after the last expression, there may be
         # whitespace. In fact, if there is a keyword, it must be preceded by
         # whitespace or a closing parenthesis.
         self._accept_whitespace()
-        while not self.end_of_string:
+        while self._position < self._input_len:
             # Between the subexpressions, only the specified keyword is
             # allowed.
             found_keyword = self._accept_keyword((keyword,))
             # If there is no keyword (or at least not the expected one), we
             # have reached the end of this compound expression.
             if not found_keyword:
-                return left_expression
+                break
             # After the keyword, we expect another subexpression. There may
             # (and in some situations must) be whitespace between the keyword
             # and the next subexpression.
             self._accept_whitespace()
-            right_expression = expect_subexpression()
-            left_expression = reduce_expressions(
-                left_expression, right_expression
-            )
+            operands.append(expect_subexpression())
             # Before the next keyword and after the last expression, there may
             # be whitespace. In fact, if there is a keyword, it must be
             # preceded by whitespace or a closing parenthesis.
             self._accept_whitespace()
-        return left_expression
-
-    def _expect_simple_expression(self) -> Expression:
+        if len(operands) == 1:
+            return operands[0]
+        flat_operands: typing.List[Node] = []
+        for operand in operands:
+            if isinstance(operand, node_type):
+                flat_operands.extend(operand.operands)
+            else:
+                flat_operands.append(operand)
+        return node_type(tuple(flat_operands))
+
+    def _expect_simple_expression(self) -> Node:
         """
         Consume and return a simple expression.
 
@@ -224,25 +250,48 @@ class CompoundExpressionParser(ParserBase):
         :return:
             consumed expression.
         """
-        parser = SimpleExpressionParser(self.remaining_input)
-        expression = parser.parse(ignore_extra_input=True)
-        self._skip(len(parser.consumed_input))
-        return expression
+        parser = SimpleExpressionParser(self._input_str, self._position)
+        node = parser.parse(ignore_extra_input=True)
+        self._position = parser.position
+        return node
 
-    def _expect_unary_expression(self) -> Expression:
+    def _expect_unary_expression(self) -> Node:
         """
         Consume and return a unary expression.
 
         Unary expressions are parentheses expressions, ``not`` expressions, and
         simple expressions.
 
+        :return:
+            consumed expression.
+        """
+        if self._nesting_depth >= _MAX_NESTING_DEPTH:
+            raise ParseError(
+                f"Expression is nested more than {_MAX_NESTING_DEPTH} levels "
+                f"deep at {self._excerpt()}.",
+                position=self._position,
+            )
+        self._nesting_depth += 1
+        try:
+            return self._expect_unary_expression_unchecked()
+        finally:
+            self._nesting_depth -= 1
+
+    def _expect_unary_expression_unchecked(self) -> Node:
+        """
+        Consume and return a unary expression without checking the nesting
+        depth.
+
+        This is the implementation of `_expect_unary_expression`, which should
+        be used instead of calling this method directly.
+
         :return:
             consumed expression.
         """
         if self._accept("("):
-            expression = self._expect_compound_or_expression()
+            node = self._expect_compound_or_expression()
             self._expect(")")
-            return expression
+            return node
         keyword = self._peek_keyword()
         if keyword == "not":
             # The not keyword must be followed by a unary expression, but in
@@ -250,8 +299,11 @@ class CompoundExpressionParser(ParserBase):
             # whitespace, so we consume this.
             self._skip(len(keyword))
             self._accept_whitespace()
-            expression = self._expect_unary_expression()
-            return _not_expression(expression)
+            if self._peek(1) == "(":
+                # "not (" only results in a single level of nesting, so we
+                # do not count the parentheses separately.
+                return NotNode(self._expect_unary_expression_unchecked())
+            return NotNode(self._expect_unary_expression())
         if keyword:
             # No other keyword is allowed here.
             raise ParseError(
@@ -300,24 +352,10 @@ class CompoundExpressionParser(ParserBase):
             if a keyword is found, but it is not at the start of the string and
             not preceded by a closing parenthesis or whitespace.
         """
-        # In order to decide whether there is a keyword, we have to look one
-        # character past the keyword’s length, so we retrieve one more
-        # character than the longest keyword has.
-        max_keyword_len = 0
-        for keyword in accepted_keywords:
-            max_keyword_len = max(max_keyword_len, len(keyword))
-        candidate_keyword = self._peek(max_keyword_len + 1)
-        found_keyword = None
-        for keyword in accepted_keywords:
-            if candidate_keyword.startswith(keyword):
-                keyword_len = len(keyword)
-                if len(candidate_keyword) == keyword_len:
-                    found_keyword = keyword
-                    break
-                following_char = candidate_keyword[keyword_len]
-                if following_char == "(" or following_char.isspace():
-                    found_keyword = keyword
-                    break
+        match = _keyword_regexp(tuple(accepted_keywords)).match(
+            self._input_str, self._position
+        )
+        found_keyword = None if match is None else match.group()
         if found_keyword is not None:
             # We look back at the last consumed character. If it was not
             # whitespace or a parenthesis, this expression is invalid because
@@ -340,12 +378,13 @@ class CompoundExpressionParser(ParserBase):
                     )
         return found_keyword
 
-    def parse(self, *, ignore_extra_input: bool = False) -> Expression:
+    def parse(self, *, ignore_extra_input: bool = False) -> Node:
         """
         Parse the input string.
 
-        If the input string matches the expected format, an `Expression` is
-        returned.
+        If the input string matches the expected format, the root `Node` of the
+        syntax tree is returned. That node can be compiled into an
+        `Expression`.
 
         If the input string does not match the expected format, an exception is
         raised.
@@ -357,7 +396,7 @@ class CompoundExpressionParser(ParserBase):
             an exception being raised.
 
         :return:
-            an instance of :class:`Expression`.
+            the root node of the syntax tree.
 
         :raise ParseError:
             if the input string does not match the expected format.
@@ -383,7 +422,10 @@ class CompoundExpressionParser(ParserBase):
         # separated by whitespace, except for parentheses. This grammar does
         # not describe the internal structure of SIMPLE_EXPRESSION either.
         # That grammer is is described in the SimpleExpressionParser.
-        expression = self._expect_compound_or_expression()
+        node = self._accept_single_simple_expression()
+        if node is not None:
+            return node
+        node = self._expect_compound_or_expression()
         if not ignore_extra_input and not self.end_of_string:
             # When we reached the end of the compound expression, this is
             # because there wasn’t another “and” or “or” keyword.
@@ -392,4 +434,20 @@ class CompoundExpressionParser(ParserBase):
                 f"end-of-string but found {self._excerpt()}.",
                 position=self._position,
             )
-        return expression
+        return node
+
+
+@functools.lru_cache(maxsize=None)
+def _keyword_regexp(keywords: typing.Tuple[str, ...]) -> "re.Pattern[str]":
+    """
+    Return a regular expression that matches any of the specified keywords.
+
+    A keyword is only matched if it is followed by whitespace, an opening
+    parenthesis, or the end of the string. The keywords are tried in the
+    specified order.
+
+    Calls are cached, so calling this function twice with the same arguments
+    returns the same regular expression.
+    """
+    alternatives = "|".join(re.escape(keyword) for keyword in keywords)
+    return re.compile(f"(?:{alternatives})(?=[\\s(]|\\Z)")
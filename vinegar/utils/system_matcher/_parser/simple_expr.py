@@ -2,57 +2,35 @@
 Parser for simple expressions.
 """
 
-import fnmatch
 import re
 import typing
 
-from .base import Expression, ParseError, ParserBase
+from .base import ParseError, ParserBase
+from .tree import PatternNode
 
+# Regular expressions matching the prefix of a data expression and of an ID
+# expression. The first group is the expression type and the second group is
+# the character following it, which is "/" if options are specified. Testing
+# all supported prefixes with a single regular expression is faster than
+# testing each of them separately.
+_DATA_PREFIX_REGEXP = re.compile(r"@data_(glob|literal|re)([/:])")
+_ID_PREFIX_REGEXP = re.compile(r"@id_(glob|literal|re)([/@])")
 
-def _data_expression(
-    key: str, pattern: str, case_sensitive: bool
-) -> Expression:
-    """
-    Return an expression that matches system data using a regular expression.
-
-    This matching is performed using `re.fullmatch`.
-    """
-    if case_sensitive:
-        flags = 0
-    else:
-        flags = re.IGNORECASE
-    regexp = re.compile(pattern, flags)
-
-    def evaluate(_system_id: str, system_data: dict) -> bool:
-        value = system_data.get(key, None)
-        # If the key cannot be found or the value is None, we treat it as an
-        # empty string for the purpose of matching.
-        if value is None:
-            value = ""
-        # If the value is not a string, we convert it to a string for matching.
-        elif not isinstance(value, str):
-            value = str(value)
-        return regexp.fullmatch(value) is not None
-
-    return evaluate
-
-
-def _id_expression(pattern: str, case_sensitive: bool) -> Expression:
-    """
-    Return an expression that matches the system ID using a regular expression.
-
-    This matching is performed using `re.fullmatch`.
-    """
-    if case_sensitive:
-        flags = 0
-    else:
-        flags = re.IGNORECASE
-    regexp = re.compile(pattern, flags)
+# Regular expression matching an unquoted key or pattern. Such a string extends
+# up to the first whitespace character, "@", "(", or ")". Finding the end of
+# the string this way is much faster than looking at each character
+# separately. The \s class uses the same definition of whitespace as
+# str.isspace().
+_UNQUOTED_REGEXP = re.compile(r"[^\s@()]+")
 
-    def evaluate(system_id: str, _system_data: dict) -> bool:
-        return regexp.fullmatch(system_id) is not None
-
-    return evaluate
+# Regular expressions matching a run of characters inside a quoted key or
+# pattern, for each kind of quotes. Such a run extends up to the first closing
+# quote or backslash. Consuming whole runs means that we only have to look at
+# the characters that end a run separately.
+_QUOTED_RUN_REGEXPS = {
+    '"': re.compile(r'[^"\\]+'),
+    "'": re.compile(r"[^'\\]+"),
+}
 
 
 class SimpleExpressionParser(ParserBase):
@@ -60,7 +38,9 @@ class SimpleExpressionParser(ParserBase):
     Parser for a simple matching expression.
     """
 
-    def _accept_data_expression(self) -> typing.Optional[Expression]:
+    __slots__ = ()
+
+    def _accept_data_expression(self) -> typing.Optional[PatternNode]:
         """
         Consume and return a data expression.
 
@@ -69,28 +49,14 @@ class SimpleExpressionParser(ParserBase):
             position, ``None`` is returned.
         """
         case_sensitive = True
-        if self._accept("@data_glob/"):
-            have_options = True
-            expr_type = "glob"
-        elif self._accept("@data_glob:"):
-            have_options = False
-            expr_type = "glob"
-        elif self._accept("@data_literal/"):
-            have_options = True
-            expr_type = "literal"
-        elif self._accept("@data_literal:"):
-            have_options = False
-            expr_type = "literal"
-        elif self._accept("@data_re/"):
-            have_options = True
-            expr_type = "re"
-        elif self._accept("@data_re:"):
-            have_options = False
-            expr_type = "re"
-        else:
+        match = _DATA_PREFIX_REGEXP.match(self._input_str, self._position)
+        if match is None:
             # If none of the possible prefixes matches, this is not a data
             # expression.
             return None
+        self._position = match.end()
+        expr_type, separator = match.groups()
+        have_options = separator == "/"
         if have_options:
             # At the moment, we only support the “i” option, which disables
             # case sensitivity.
@@ -104,25 +70,11 @@ class SimpleExpressionParser(ParserBase):
         # Now we expect a pattern.
         pattern_position = self._position
         pattern = self._expect_glob_pattern_or_re()
-        # When handling a glob expression, we have to translate the glob
-        # pattern to a regular expression for matching.
-        if expr_type == "glob":
-            pattern = fnmatch.translate(pattern)
-        # If we are handling a literal expression, we have to escape the string
-        # in order to get a proper regular expression. Alternatively, we could
-        # use a different expression function that compares strings instead of
-        # using the re module, but this would make the code more complicated.
-        elif expr_type == "literal":
-            pattern = re.escape(pattern)
-        try:
-            return _data_expression(key, pattern, case_sensitive)
-        except re.error as err:
-            raise ParseError(
-                f"Could not compile regular expression pattern {pattern!r}.",
-                position=pattern_position,
-            ) from err
+        node = PatternNode(key, expr_type, pattern, case_sensitive)
+        self._check_regex(node, pattern_position)
+        return node
 
-    def _accept_id_expression(self) -> typing.Optional[Expression]:
+    def _accept_id_expression(self) -> typing.Optional[PatternNode]:
         """
         Consume and return an ID expression.
 
@@ -131,28 +83,14 @@ class SimpleExpressionParser(ParserBase):
             position, ``None`` is returned.
         """
         case_sensitive = True
-        if self._accept("@id_glob/"):
-            have_options = True
-            expr_type = "glob"
-        elif self._accept("@id_glob@"):
-            have_options = False
-            expr_type = "glob"
-        elif self._accept("@id_literal/"):
-            have_options = True
-            expr_type = "literal"
-        elif self._accept("@id_literal@"):
-            have_options = False
-            expr_type = "literal"
-        elif self._accept("@id_re/"):
-            have_options = True
-            expr_type = "re"
-        elif self._accept("@id_re@"):
-            have_options = False
-            expr_type = "re"
-        else:
-            # If none of the possible prefixes matches, this is not a data
+        match = _ID_PREFIX_REGEXP.match(self._input_str, self._position)
+        if match is None:
+            # If none of the possible prefixes matches, this is not an ID
             # expression.
             return None
+        self._position = match.end()
+        expr_type, separator = match.groups()
+        have_options = separator == "/"
         if have_options:
             # At the moment, we only support the “i” option, which disables
             # case sensitivity.
@@ -162,21 +100,41 @@ class SimpleExpressionParser(ParserBase):
         # After the prefix, we expect the pattern.
         pattern_position = self._position
         pattern = self._expect_glob_pattern_or_re()
-        # When handling a glob expression, We have to translate the glob
-        # pattern to a regular expression for matching.
-        if expr_type == "glob":
-            pattern = fnmatch.translate(pattern)
-        # If we are handling a literal expression, we have to escape the string
-        # in order to get a proper regular expression. Alternatively, we could
-        # use a different expression function that compares strings instead of
-        # using the re module, but this would make the code more complicated.
-        elif expr_type == "literal":
-            pattern = re.escape(pattern)
+        node = PatternNode(None, expr_type, pattern, case_sensitive)
+        self._check_regex(node, pattern_position)
+        return node
+
+    @staticmethod
+    def _check_regex(node: PatternNode, pattern_position: int):
+        """
+        Check that the regular expression for a pattern node can be compiled.
+
+        The regular expression is only compiled when the expression is
+        compiled, but we want to detect invalid regular expressions while
+        parsing, so that we can report the position of the invalid pattern.
+
+        :param node:
+            node that shall be checked.
+        :param pattern_position:
+            position of the pattern in the parsed string.
+
+        :raise ParseError:
+            if the regular expression is invalid.
+        """
+        # Glob patterns and literal strings are always translated to valid
+        # regular expressions, so we only have to check regular expressions
+        # that have been specified by the user. Compiling the regular
+        # expression here is not as wasteful as it might seem because the re
+        # module caches compiled regular expressions.
+        if node.pattern_type != "re":
+            return
+        flags = 0 if node.case_sensitive else re.IGNORECASE
         try:
-            return _id_expression(pattern, case_sensitive)
+            re.compile(node.regex, flags)
         except re.error as err:
             raise ParseError(
-                f"Could not compile regular expression pattern {pattern!r}.",
+                "Could not compile regular expression pattern "
+                f"{node.regex!r}.",
                 position=pattern_position,
             ) from err
 
@@ -195,15 +153,24 @@ class SimpleExpressionParser(ParserBase):
         """
         last_char_was_escape = False
         used_quotes = self._accept_any_of(("'", '"'))
-        pattern = ""
-        while not self.end_of_string:
+        # We collect the parts of the pattern in a list and join them in the
+        # end, so that we do not create a new string for each part.
+        parts: typing.List[str] = []
+        while self._position < self._input_len:
             if last_char_was_escape:
                 assert used_quotes is not None
                 # The only escape sequences that we support are to escape the
                 # used type of quotes and to escape the backslash itself.
-                pattern += self._expect_any_of((used_quotes, "\\"))
+                parts.append(self._expect_any_of((used_quotes, "\\")))
                 last_char_was_escape = False
             elif used_quotes:
+                match = _QUOTED_RUN_REGEXPS[used_quotes].match(
+                    self._input_str, self._position
+                )
+                if match is not None:
+                    parts.append(match.group())
+                    self._position = match.end()
+                    continue
                 char = self._expect_any_char()
                 # A backslash inside quotes escapes the next character.
                 if char == "\\":
@@ -212,23 +179,18 @@ class SimpleExpressionParser(ParserBase):
                 # The same kind of quotes that were used at the beginning
                 # indicate the end of the pattern.
                 if char == used_quotes:
-                    return pattern
-                # Everything else is a part of the pattern.
-                pattern += char
+                    return "".join(parts)
             else:
-                char = self._peek(1)
-                if char.isspace() or char in ("@", "(", ")"):
-                    # Unquoted patterns must not be empty.
-                    if not pattern:
-                        raise ParseError(
-                            "Expected pattern expression but found "
-                            f"{self._excerpt()}.",
-                            position=self._position,
-                        )
-                    return pattern
-                # Everything else is a part of the pattern.
-                pattern += char
-                self._skip(1)
+                match = _UNQUOTED_REGEXP.match(self._input_str, self._position)
+                # Unquoted patterns must not be empty.
+                if match is None:
+                    raise ParseError(
+                        "Expected pattern expression but found "
+                        f"{self._excerpt()}.",
+                        position=self._position,
+                    )
+                self._position = match.end()
+                return match.group()
         # We only make it here when we reach the end of the string.
         # If the last character was the backslash, this is an error because the
         # escape sequence is incomplete.
@@ -248,12 +210,10 @@ class SimpleExpressionParser(ParserBase):
         # this is an error as well, because the pattern must not be empty
         # unless it is quoted (and it is not quoted because in that case we
         # would have returned earlier).
-        if not pattern:
-            raise ParseError(
-                "Expected pattern expression but found end-of-string.",
-                position=self._position,
-            )
-        return pattern
+        raise ParseError(
+            "Expected pattern expression but found end-of-string.",
+            position=self._position,
+        )
 
     def _expect_key(self) -> str:
         """
@@ -269,19 +229,28 @@ class SimpleExpressionParser(ParserBase):
         """
         last_char_was_escape = False
         used_quotes = self._accept_any_of(("'", '"'))
-        key = ""
-        while not self.end_of_string:
+        # We collect the parts of the key in a list and join them in the end,
+        # so that we do not create a new string for each part.
+        parts: typing.List[str] = []
+        while self._position < self._input_len:
             if last_char_was_escape:
                 assert used_quotes is not None
                 # The only escape sequences that we support are to escape the
                 # used type of quotes and to escape the backslash itself.
-                key += self._expect_any_of((used_quotes, "\\"))
+                parts.append(self._expect_any_of((used_quotes, "\\")))
                 last_char_was_escape = False
             elif used_quotes:
+                match = _QUOTED_RUN_REGEXPS[used_quotes].match(
+                    self._input_str, self._position
+                )
+                if match is not None:
+                    parts.append(match.group())
+                    self._position = match.end()
+                    continue
                 char = self._peek(1)
                 # The quotes must not be closed without any content (empty keys
                 # are not allowed).
-                if not key and char == used_quotes:
+                if not parts and char == used_quotes:
                     raise ParseError(
                         f"Expected any character except {used_quotes!r} but "
                         f"found {self._excerpt()}.",
@@ -295,22 +264,17 @@ class SimpleExpressionParser(ParserBase):
                 # The same kind of quotes that were used at the beginning
                 # indicate the end of the key.
                 if char == used_quotes:
-                    return key
-                # Everything else is a part of the key.
-                key += char
+                    return "".join(parts)
             else:
-                char = self._peek(1)
-                if char.isspace() or char in ("@", "(", ")"):
-                    if not key:
-                        raise ParseError(
-                            "Expected any non-whitespace character except "
-                            f"['@', '(', ')'] but found {self._excerpt()}.",
-                            position=self._position,
-                        )
-                    return key
-                # Everything else is a part of the key.
-                key += char
-                self._skip(1)
+                match = _UNQUOTED_REGEXP.match(self._input_str, self._position)
+                if match is None:
+                    raise ParseError(
+                        "Expected any non-whitespace character except "
+                        f"['@', '(', ')'] but found {self._excerpt()}.",
+                        position=self._position,
+                    )
+                self._position = match.end()
+                return match.group()
         # We only make it here when we reach the end of the string.
         # If the last character was the backslash, this is an error because the
         # escape sequence is incomplete.
@@ -328,15 +292,13 @@ class SimpleExpressionParser(ParserBase):
             self._expect(used_quotes)
         # If we reached the end of the string without reading any characters,
         # this is an error as well, because the key must not be empty.
-        if not key:
-            self._expect_any_char()
-        return key
+        raise ParseError("Premature end-of-string.", position=self._position)
 
-    def parse(self, *, ignore_extra_input: bool = False) -> Expression:
+    def parse(self, *, ignore_extra_input: bool = False) -> PatternNode:
         """
         Parse the input string.
 
-        If the input string matches the expected format, an `Expression` is
+        If the input string matches the expected format, a `PatternNode` is
         returned.
 
         If the input string does not match the expected format, an exception is
@@ -349,7 +311,7 @@ class SimpleExpressionParser(ParserBase):
             an exception being raised.
 
         :return:
-            an instance of :class:`Expression`.
+            an instance of :class:`PatternNode`.
 
         :raise ParseError:
             if the input string does not match the expected format.
@@ -417,12 +379,12 @@ class SimpleExpressionParser(ParserBase):
         # The UNQUOTED_UNLIMITED_VALUE is any string that does not contain any
         # whitespace characters or the characters “@”, “(”, or “)”. The string
         # must not start with the characters “"” or “'”.
-        expression = self._accept_data_expression()
-        if expression:
-            return expression
-        expression = self._accept_id_expression()
-        if expression:
-            return expression
+        node = self._accept_data_expression()
+        if node is not None:
+            return node
+        node = self._accept_id_expression()
+        if node is not None:
+            return node
         # We do not allow any expressions that start with “@” and do not
         # specify one of the supported types. This is to avoid strange behavior
         # in case of typos and in order to allow adding additional types in the
@@ -437,10 +399,7 @@ class SimpleExpressionParser(ParserBase):
         # case, we do not allow an empty unquoted pattern, because it would be
         # indistinguishable from a pattern expression that is simply missing.
         pattern = self._expect_glob_pattern_or_re()
-        # We have to translate the glob pattern to a regular expression for
-        # matching.
-        pattern = fnmatch.translate(pattern)
-        expression = _id_expression(pattern, False)
+        node = PatternNode(None, "glob", pattern, False)
         if not ignore_extra_input:
             self._expect_end_of_string()
-        return expression
+        return node
@@ -0,0 +1,886 @@
+"""
+Syntax tree for matcher expressions.
+
+The parsers build a tree of `Node` objects. This tree is then compiled into an
+`Expression` that can be evaluated efficiently. Separating these two steps
+allows the compilation step to look at a complete subtree, so that it can
+combine several nodes into a more efficient expression.
+"""
+
+import abc
+import collections
+import dataclasses
+import fnmatch
+import functools
+import itertools
+import re
+import typing
+
+from .base import Expression, ManyExpression
+
+# Maximum nesting depth of operators in the source code generated by
+# _compile_source. Deeper subtrees are compiled into separate functions. The
+# parser of Python 3.8 fails with a MemoryError ("parser stack overflow") for
+# expressions that are nested about 60 levels deep, so we stay well below that.
+# Expressions nested this deeply are rare, so the additional function calls do
+# not matter.
+_MAX_SOURCE_DEPTH = 20
+
+# Regular expression matching regular expressions that only consist of
+# characters that match themselves.
+_PLAIN_REGEXP = re.compile(r"[0-9A-Za-z_\-]*")
+
+
+class Node(abc.ABC):
+    """
+    Node in the syntax tree of a matcher expression.
+
+    Nodes are immutable and can be compared and hashed, so that two subtrees
+    that have the same structure are considered equal.
+    """
+
+    @abc.abstractmethod
+    def compile(self) -> Expression:
+        """
+        Compile this node (and all of its children) into an expression.
+
+        :return:
+            expression that evaluates this node.
+        """
+        raise NotImplementedError()
+
+    def compile_many(self) -> ManyExpression:
+        """
+        Compile this node (and all of its children) into an expression that
+        is evaluated for many system IDs at once.
+
+        The default implementation evaluates the expression returned by
+        `compile` for each system ID. Nodes that can do better override this
+        method.
+
+        :return:
+            expression that evaluates this node for many system IDs.
+        """
+        expression = self.compile()
+
+        def evaluate(
+            system_ids: typing.Sequence[str], system_data: dict
+        ) -> typing.List[bool]:
+            return [
+                expression(system_id, system_data) for system_id in system_ids
+            ]
+
+        return evaluate
+
+    def compile_source(self, leaves: typing.List["Node"], depth: int) -> str:
+        """
+        Compile this node into Python source code for a boolean expression.
+
+        Nodes for the ``and``, ``not``, and ``or`` operators generate the
+        corresponding Python operators, so that the whole tree of operators can
+        be compiled into a single Python function (see `_compile_source`). All
+        other nodes are leaves: they are compiled by calling `compile` and
+        their result is included in the source code by `_compile_source`.
+        Operator nodes that are nested too deeply are treated like leaves as
+        well (see `_MAX_SOURCE_DEPTH`).
+
+        :param leaves:
+            list of leaf nodes. Leaf nodes are appended to this list and are
+            represented in the generated source code by a replacement field
+            (as understood by `str.format`) with their index in this list.
+        :param depth:
+            nesting depth of this node in the generated source code.
+        :return:
+            Python source code for this node.
+        """
+        leaves.append(self)
+        return "{" + str(len(leaves) - 1) + "}"
+
+    def simplify(self) -> "Node":
+        """
+        Return a node that is equivalent to this node, but might be cheaper to
+        evaluate.
+
+        Double negations are removed and patterns that match everything are
+        replaced by constants, which are then folded into the operators using
+        them. The default implementation returns this node unchanged.
+
+        :return:
+            simplified node (might be this node).
+        """
+        return self
+
+
+@dataclasses.dataclass(frozen=True)
+class AndNode(Node):
+    """
+    Node that matches if all of its operands match.
+    """
+
+    operands: typing.Tuple[Node, ...]
+    """
+    Operands of the ``and`` operator. There are always at least two operands.
+    """
+
+    def compile(self) -> Expression:
+        return _compile_source(self)
+
+    def compile_source(self, leaves: typing.List[Node], depth: int) -> str:
+        if depth >= _MAX_SOURCE_DEPTH:
+            return super().compile_source(leaves, depth)
+        return (
+            "("
+            + " and ".join(
+                operand.compile_source(leaves, depth + 1)
+                for operand in self.operands
+            )
+            + ")"
+        )
+
+    def simplify(self) -> Node:
+        return _simplify_operands(AndNode, self.operands, True)
+
+
+@dataclasses.dataclass(frozen=True)
+class ConstantNode(Node):
+    """
+    Node that always evaluates to the same value.
+
+    Such nodes are never created by the parser, but only when simplifying a
+    syntax tree.
+    """
+
+    value: bool
+    """
+    Value that this node evaluates to.
+    """
+
+    def compile(self) -> Expression:
+        return _constant_expression(self.value)
+
+    def compile_many(self) -> ManyExpression:
+        value = self.value
+
+        def evaluate(
+            system_ids: typing.Sequence[str], _system_data: dict
+        ) -> typing.List[bool]:
+            return [value] * len(system_ids)
+
+        return evaluate
+
+
+@dataclasses.dataclass(frozen=True)
+class LiteralSetNode(Node):
+    """
+    Node that matches if the system ID or a value from the system data is equal
+    to one of several strings.
+
+    Such nodes are never created by the parser, but only when compiling an
+    ``or`` operator that has several literal patterns as its operands.
+    """
+
+    key: typing.Optional[str]
+    """
+    Key of the value in the system data that is matched. If ``None``, the
+    system ID is matched instead.
+    """
+
+    literals: typing.FrozenSet[str]
+    """
+    Strings that are compared with the value. If case is ignored, these
+    strings must only consist of ASCII characters.
+    """
+
+    case_sensitive: bool
+    """
+    ``True`` if matching is case sensitive, ``False`` if case is ignored.
+    """
+
+    def compile(self) -> Expression:
+        if self.key is None:
+            return _id_literal_set_expression(
+                self.literals, self.regex, self.case_sensitive
+            )
+        return _data_literal_set_expression(
+            self.key, self.literals, self.regex, self.case_sensitive
+        )
+
+    def compile_many(self) -> ManyExpression:
+        if self.key is None and self.case_sensitive:
+            contains = self.literals.__contains__
+
+            def evaluate(
+                system_ids: typing.Sequence[str], _system_data: dict
+            ) -> typing.List[bool]:
+                return list(map(contains, system_ids))
+
+            return evaluate
+        return super().compile_many()
+
+    @property
+    def regex(self) -> str:
+        """
+        Regular expression that is equivalent to this node.
+        """
+        # Sorting the literals makes the regular expression (and thus the
+        # cached expression) independent of the iteration order of the set.
+        return "|".join(
+            re.escape(literal) for literal in sorted(self.literals)
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class NotNode(Node):
+    """
+    Node that matches if its operand does not match.
+    """
+
+    operand: Node
+    """
+    Operand of the ``not`` operator.
+    """
+
+    def compile(self) -> Expression:
+        return _compile_source(self)
+
+    def compile_many(self) -> ManyExpression:
+        many_expression = self.operand.compile_many()
+
+        def evaluate(
+            system_ids: typing.Sequence[str], system_data: dict
+        ) -> typing.List[bool]:
+            return [
+                not result
+                for result in many_expression(system_ids, system_data)
+            ]
+
+        return evaluate
+
+    def compile_source(self, leaves: typing.List[Node], depth: int) -> str:
+        if depth >= _MAX_SOURCE_DEPTH:
+            return super().compile_source(leaves, depth)
+        return "(not " + self.operand.compile_source(leaves, depth + 1) + ")"
+
+    def simplify(self) -> Node:
+        operand = self.operand.simplify()
+        if isinstance(operand, NotNode):
+            return operand.operand
+        if isinstance(operand, ConstantNode):
+            return ConstantNode(not operand.value)
+        return NotNode(operand)
+
+
+@dataclasses.dataclass(frozen=True)
+class OrNode(Node):
+    """
+    Node that matches if any of its operands matches.
+    """
+
+    operands: typing.Tuple[Node, ...]
+    """
+    Operands of the ``or`` operator. There are always at least two operands.
+    """
+
+    def compile(self) -> Expression:
+        return _compile_source(self)
+
+    def compile_source(self, leaves: typing.List[Node], depth: int) -> str:
+        if depth >= _MAX_SOURCE_DEPTH:
+            return super().compile_source(leaves, depth)
+        return (
+            "("
+            + " or ".join(
+                operand.compile_source(leaves, depth + 1)
+                for operand in _merge_pattern_nodes(self.operands)
+            )
+            + ")"
+        )
+
+    def simplify(self) -> Node:
+        return _simplify_operands(OrNode, self.operands, False)
+
+
+@dataclasses.dataclass(frozen=True)
+class PatternNode(Node):
+    """
+    Node that matches the system ID or a value from the system data against a
+    pattern.
+    """
+
+    key: typing.Optional[str]
+    """
+    Key of the value in the system data that is matched. If ``None``, the
+    system ID is matched instead.
+    """
+
+    pattern_type: str
+    """
+    Type of the pattern. This is ``glob`` for glob patterns (as understood by
+    `fnmatch`), ``literal`` for literal strings, and ``re`` for regular
+    expressions.
+    """
+
+    pattern: str
+    """
+    Pattern as specified in the expression.
+    """
+
+    case_sensitive: bool
+    """
+    ``True`` if matching is case sensitive, ``False`` if case is ignored.
+    """
+
+    def compile(self) -> Expression:
+        string_test = self.string_test
+        if string_test is not None:
+            method_name, needle = string_test
+            if self.key is None:
+                return _id_string_expression(
+                    method_name, needle, self.regex, self.case_sensitive
+                )
+            return _data_string_expression(
+                self.key, method_name, needle, self.regex, self.case_sensitive
+            )
+        if self.key is None:
+            return _id_expression(self.regex, self.case_sensitive)
+        return _data_expression(self.key, self.regex, self.case_sensitive)
+
+    def compile_many(self) -> ManyExpression:
+        if self.key is not None:
+            # The system data is the same for all system IDs, so the result is
+            # the same for all of them and only has to be calculated once.
+            expression = self.compile()
+
+            def evaluate_data(
+                system_ids: typing.Sequence[str], system_data: dict
+            ) -> typing.List[bool]:
+                return [expression("", system_data)] * len(system_ids)
+
+            return evaluate_data
+        string_test = self.string_test
+        if string_test is not None and self.case_sensitive:
+            method_name, needle = string_test
+            test = getattr(str, method_name)
+
+            def evaluate_string(
+                system_ids: typing.Sequence[str], _system_data: dict
+            ) -> typing.List[bool]:
+                return list(map(test, system_ids, itertools.repeat(needle)))
+
+            return evaluate_string
+        if self.case_sensitive:
+            flags = 0
+        else:
+            flags = re.IGNORECASE
+        fullmatch = re.compile(self.regex, flags).fullmatch
+
+        def evaluate_regex(
+            system_ids: typing.Sequence[str], _system_data: dict
+        ) -> typing.List[bool]:
+            # Using map means that the loop calling the regular expression
+            # runs in C code.
+            return [match is not None for match in map(fullmatch, system_ids)]
+
+        return evaluate_regex
+
+    @property
+    def regex(self) -> str:
+        """
+        Regular expression that is equivalent to the pattern.
+        """
+        # When handling a glob expression, we have to translate the glob
+        # pattern to a regular expression for matching.
+        if self.pattern_type == "glob":
+            return fnmatch.translate(self.pattern)
+        # If we are handling a literal expression, we have to escape the string
+        # in order to get a proper regular expression.
+        if self.pattern_type == "literal":
+            return re.escape(self.pattern)
+        return self.pattern
+
+    def simplify(self) -> Node:
+        # A glob pattern that only consists of "*" matches every string, and
+        # system data values are always converted to strings before matching.
+        if (
+            self.pattern_type == "glob"
+            and self.pattern
+            and not self.pattern.strip("*")
+        ):
+            return ConstantNode(True)
+        return self
+
+    @property
+    def string_test(self) -> typing.Optional[typing.Tuple[str, str]]:
+        """
+        Method of `str` that can be used instead of the regular expression.
+
+        This is a tuple of the method name (``__contains__``, ``__eq__``,
+        ``endswith``, or ``startswith``) and the string that is passed to the
+        method. It is ``None`` if the pattern cannot be matched by a single
+        call to one of these methods.
+
+        For case insensitive patterns, this is only set if the pattern only
+        consists of ASCII characters, because the rules that `re` uses for
+        ignoring case are only trivial to replicate for these characters.
+        """
+        if not self.case_sensitive and not self.pattern.isascii():
+            return None
+        if self.pattern_type == "literal":
+            return "__eq__", self.pattern
+        # A regular expression that only consists of characters that do not
+        # have a special meaning only matches itself. We only look for the
+        # most common of these characters (the ones that are typically used
+        # in host names).
+        if self.pattern_type == "re":
+            if _PLAIN_REGEXP.fullmatch(self.pattern) is None:
+                return None
+            return "__eq__", self.pattern
+        return _glob_string_test(self.pattern)
+
+
+def _compile_source(node: Node) -> Expression:
+    """
+    Compile a tree of ``and``, ``not``, and ``or`` operators into a single
+    Python function.
+
+    Combining the expressions for the operands with closures would mean one
+    additional function call for each operator when evaluating the expression.
+    Instead, we generate the source code of a function that uses Python's own
+    boolean operators (which keep their short-circuit behavior) and compile
+    it. The generated source code only consists of these operators and calls
+    of the expressions for the leaves. Patterns and keys specified by the
+    user are never part of the source code, so there is no risk of injecting
+    code through an expression.
+
+    If the same leaf appears more than once (e.g. in ``(a or b) and not (a or
+    c)``), it is only evaluated once and the result is stored in a local
+    variable.
+
+    Operators that are nested more deeply than `_MAX_SOURCE_DEPTH` are
+    compiled into separate functions, which are called like leaves.
+
+    :param node:
+        node that shall be compiled.
+    :return:
+        expression that evaluates the node.
+    """
+    leaves: typing.List[Node] = []
+    source = node.compile_source(leaves, 0)
+    leaf_counts = collections.Counter(leaves)
+    leaf_indices: typing.Dict[Node, int] = {}
+    for leaf in leaves:
+        leaf_indices.setdefault(leaf, len(leaf_indices))
+    leaf_sources = []
+    for leaf in leaves:
+        index = leaf_indices[leaf]
+        leaf_source = f"_e{index}(system_id, system_data)"
+        if leaf_counts[leaf] > 1:
+            # We do not know which of the occurrences is evaluated first
+            # (some of them might be skipped due to short-circuit evaluation),
+            # so each of them has to check whether the result is available.
+            leaf_source = (
+                f"(_r{index} if _r{index} is not None "
+                f"else (_r{index} := {leaf_source}))"
+            )
+        leaf_sources.append(leaf_source)
+    source_lines = ["def evaluate(system_id, system_data):"]
+    for leaf, index in leaf_indices.items():
+        if leaf_counts[leaf] > 1:
+            source_lines.append(f"    _r{index} = None")
+    source_lines.append(f"    return {source.format(*leaf_sources)}")
+    namespace: typing.Dict[str, typing.Any] = {
+        f"_e{index}": leaf.compile() for leaf, index in leaf_indices.items()
+    }
+    # The generated code does not need any built-in functions.
+    namespace["__builtins__"] = {}
+    exec(  # pylint: disable=exec-used
+        "\n".join(source_lines) + "\n", namespace
+    )
+    return namespace["evaluate"]
+
+
+@functools.lru_cache(maxsize=None)
+def _constant_expression(value: bool) -> Expression:
+    """
+    Return an expression that always evaluates to the specified value.
+    """
+
+    def evaluate(_system_id: str, _system_data: dict) -> bool:
+        return value
+
+    return evaluate
+
+
+# The same simple expression often appears in many different compound
+# expressions (e.g. "*.example.com" combined with different other expressions).
+# Expressions do not have any state, so we can share them between all compound
+# expressions and avoid compiling the regular expression again.
+@functools.lru_cache(maxsize=1024, typed=True)
+def _data_expression(
+    key: str, pattern: str, case_sensitive: bool
+) -> Expression:
+    """
+    Return an expression that matches system data using a regular expression.
+
+    This matching is performed using `re.fullmatch`.
+
+    Calls are cached, so calling this function twice with the same arguments
+    returns the same expression.
+    """
+    if case_sensitive:
+        flags = 0
+    else:
+        flags = re.IGNORECASE
+    # Binding the method once saves an attribute lookup for each evaluation.
+    fullmatch = re.compile(pattern, flags).fullmatch
+
+    def evaluate(_system_id: str, system_data: dict) -> bool:
+        value = system_data.get(key, None)
+        # Values are strings in almost all cases, so we check for this first
+        # and only look at the other cases when needed. If the key cannot be
+        # found or the value is None, we treat it as an empty string for the
+        # purpose of matching. Any other value is converted to a string.
+        if not isinstance(value, str):
+            value = "" if value is None else str(value)
+        return fullmatch(value) is not None
+
+    return evaluate
+
+
+@functools.lru_cache(maxsize=1024, typed=True)
+def _data_literal_set_expression(
+    key: str,
+    literals: typing.FrozenSet[str],
+    regex: str,
+    case_sensitive: bool,
+) -> Expression:
+    """
+    Return an expression that matches system data by looking it up in a set of
+    strings.
+
+    This gives the same result as `_data_expression` for the equivalent
+    regular expression. Like for `_data_string_expression`, the regular
+    expression is only used when ignoring case and the value contains
+    non-ASCII characters.
+
+    Calls are cached, so calling this function twice with the same arguments
+    returns the same expression.
+    """
+    if case_sensitive:
+
+        def evaluate(_system_id: str, system_data: dict) -> bool:
+            value = system_data.get(key, None)
+            if not isinstance(value, str):
+                value = "" if value is None else str(value)
+            return value in literals
+
+        return evaluate
+
+    lowered_literals = frozenset(literal.lower() for literal in literals)
+    regex_expression = _data_expression(key, regex, False)
+
+    def evaluate_ignore_case(system_id: str, system_data: dict) -> bool:
+        value = system_data.get(key, None)
+        if not isinstance(value, str):
+            value = "" if value is None else str(value)
+        if value.isascii():
+            return value.lower() in lowered_literals
+        return regex_expression(system_id, system_data)
+
+    return evaluate_ignore_case
+
+
+@functools.lru_cache(maxsize=1024, typed=True)
+def _data_string_expression(
+    key: str, method_name: str, needle: str, regex: str, case_sensitive: bool
+) -> Expression:
+    """
+    Return an expression that matches system data by calling a method of
+    `str` (see `PatternNode.string_test`).
+
+    This gives the same result as `_data_expression` for the equivalent
+    regular expression, but avoids the overhead of using the regular
+    expression in most cases. Case insensitive matching is only supported for
+    needles that only consist of ASCII characters.
+
+    Calls are cached, so calling this function twice with the same arguments
+    returns the same expression.
+    """
+    test = getattr(str, method_name)
+    if case_sensitive:
+
+        def evaluate(_system_id: str, system_data: dict) -> bool:
+            value = system_data.get(key, None)
+            if not isinstance(value, str):
+                value = "" if value is None else str(value)
+            return test(value, needle)
+
+        return evaluate
+
+    lowered_needle = needle.lower()
+    # For values that contain non-ASCII characters, we fall back to the
+    # regular expression, because some of these characters (e.g. the Kelvin
+    # sign) are considered equal to an ASCII character when ignoring case.
+    regex_expression = _data_expression(key, regex, False)
+
+    def evaluate_ignore_case(system_id: str, system_data: dict) -> bool:
+        value = system_data.get(key, None)
+        if not isinstance(value, str):
+            value = "" if value is None else str(value)
+        if value.isascii():
+            return test(value.lower(), lowered_needle)
+        return regex_expression(system_id, system_data)
+
+    return evaluate_ignore_case
+
+
+def _glob_string_test(pattern: str) -> typing.Optional[typing.Tuple[str, str]]:
+    """
+    Return the method of `str` that can be used instead of matching a glob
+    pattern.
+
+    fnmatch only treats "*", "?", and "[" specially. If there are no wildcards
+    except for "*" at the start or the end of the pattern, we can test for a
+    prefix, a suffix, or a substring. Several "*" in a row are the same as a
+    single one.
+
+    :param pattern:
+        glob pattern.
+    :return:
+        tuple of the method name and the string that is passed to the method
+        (see `PatternNode.string_test`) or ``None`` if the pattern cannot be
+        matched by a single call to one of these methods.
+    """
+    needle = pattern.strip("*")
+    if any(char in needle for char in "*?["):
+        return None
+    starts_with_wildcard = pattern.startswith("*")
+    ends_with_wildcard = pattern.endswith("*")
+    if starts_with_wildcard and ends_with_wildcard:
+        return "__contains__", needle
+    if starts_with_wildcard:
+        return "endswith", needle
+    if ends_with_wildcard:
+        return "startswith", needle
+    return "__eq__", needle
+
+
+@functools.lru_cache(maxsize=1024, typed=True)
+def _id_expression(pattern: str, case_sensitive: bool) -> Expression:
+    """
+    Return an expression that matches the system ID using a regular expression.
+
+    This matching is performed using `re.fullmatch`.
+
+    Calls are cached, so calling this function twice with the same arguments
+    returns the same expression.
+    """
+    if case_sensitive:
+        flags = 0
+    else:
+        flags = re.IGNORECASE
+    fullmatch = re.compile(pattern, flags).fullmatch
+
+    def evaluate(system_id: str, _system_data: dict) -> bool:
+        return fullmatch(system_id) is not None
+
+    return evaluate
+
+
+@functools.lru_cache(maxsize=1024, typed=True)
+def _id_literal_set_expression(
+    literals: typing.FrozenSet[str], regex: str, case_sensitive: bool
+) -> Expression:
+    """
+    Return an expression that matches the system ID by looking it up in a set
+    of strings.
+
+    This gives the same result as `_id_expression` for the equivalent regular
+    expression. Like for `_id_string_expression`, the regular expression is
+    only used when ignoring case and the system ID contains non-ASCII
+    characters.
+
+    Calls are cached, so calling this function twice with the same arguments
+    returns the same expression.
+    """
+    if case_sensitive:
+
+        def evaluate(system_id: str, _system_data: dict) -> bool:
+            return system_id in literals
+
+        return evaluate
+
+    lowered_literals = frozenset(literal.lower() for literal in literals)
+    regex_expression = _id_expression(regex, False)
+
+    def evaluate_ignore_case(system_id: str, system_data: dict) -> bool:
+        if system_id.isascii():
+            return system_id.lower() in lowered_literals
+        return regex_expression(system_id, system_data)
+
+    return evaluate_ignore_case
+
+
+@functools.lru_cache(maxsize=1024, typed=True)
+def _id_string_expression(
+    method_name: str, needle: str, regex: str, case_sensitive: bool
+) -> Expression:
+    """
+    Return an expression that matches the system ID by calling a method of
+    `str` (see `PatternNode.string_test`).
+
+    This gives the same result as `_id_expression` for the equivalent regular
+    expression, but avoids the overhead of using the regular expression in
+    most cases. Case insensitive matching is only supported for needles that
+    only consist of ASCII characters.
+
+    Calls are cached, so calling this function twice with the same arguments
+    returns the same expression.
+    """
+    test = getattr(str, method_name)
+    if case_sensitive:
+        if method_name == "__eq__":
+            # Comparing strings is the most common case, and using the
+            # operator is considerably faster than calling the method.
+
+            def evaluate_equal(system_id: str, _system_data: dict) -> bool:
+                return system_id == needle
+
+            return evaluate_equal
+
+        def evaluate(system_id: str, _system_data: dict) -> bool:
+            return test(system_id, needle)
+
+        return evaluate
+
+    lowered_needle = needle.lower()
+    # For system IDs that contain non-ASCII characters, we fall back to the
+    # regular expression (see _data_string_expression).
+    regex_expression = _id_expression(regex, False)
+
+    def evaluate_ignore_case(system_id: str, system_data: dict) -> bool:
+        if system_id.isascii():
+            return test(system_id.lower(), lowered_needle)
+        return regex_expression(system_id, system_data)
+
+    return evaluate_ignore_case
+
+
+def _merge_pattern_nodes(
+    nodes: typing.Iterable[Node],
+) -> typing.List[Node]:
+    """
+    Merge the pattern nodes that are operands of an ``or`` operator.
+
+    Patterns that compare the same value (the system ID or the system data
+    value for the same key) with a single string are merged into a
+    `LiteralSetNode`, so that all of them can be tested with a single set
+    lookup. This is done separately for case sensitive and case insensitive
+    patterns.
+
+    All other glob and literal patterns that are matched against the same
+    value are merged into a single regular expression that uses an
+    alternation. This way, the regular expression engine can test all patterns
+    in a single call.
+
+    Regular expressions specified by the user are never merged into another
+    regular expression because they might use features (e.g. back references
+    or global flags) that would change their meaning when being combined with
+    other expressions.
+
+    :param nodes:
+        operands of the ``or`` operator.
+    :return:
+        operands where mergeable pattern nodes have been replaced by a single
+        node for each value being matched. The order of the other operands is
+        preserved.
+    """
+    literal_groups: typing.Dict[
+        typing.Tuple[typing.Optional[str], bool], typing.List[PatternNode]
+    ] = {}
+    regex_groups: typing.Dict[
+        typing.Optional[str], typing.List[PatternNode]
+    ] = {}
+    merged_nodes: typing.List[Node] = []
+    for node in nodes:
+        if not isinstance(node, PatternNode):
+            merged_nodes.append(node)
+            continue
+        string_test = node.string_test
+        if string_test is not None and string_test[0] == "__eq__":
+            literal_groups.setdefault(
+                (node.key, node.case_sensitive), []
+            ).append(node)
+        elif node.pattern_type != "re":
+            regex_groups.setdefault(node.key, []).append(node)
+        else:
+            merged_nodes.append(node)
+    for (key, case_sensitive), pattern_nodes in literal_groups.items():
+        if len(pattern_nodes) > 1:
+            merged_nodes.append(
+                LiteralSetNode(
+                    key,
+                    frozenset(node.pattern for node in pattern_nodes),
+                    case_sensitive,
+                )
+            )
+        elif pattern_nodes[0].pattern_type != "re":
+            # A single literal can still be merged into the regular
+            # expression for the other patterns.
+            regex_groups.setdefault(key, []).append(pattern_nodes[0])
+        else:
+            merged_nodes.append(pattern_nodes[0])
+    for key, pattern_nodes in regex_groups.items():
+        if len(pattern_nodes) == 1:
+            merged_nodes.append(pattern_nodes[0])
+            continue
+        # Each pattern is wrapped in a group that sets the flags needed for
+        # it, so patterns that are case sensitive and ones that are not can be
+        # part of the same regular expression.
+        regex = "|".join(
+            f"(?{'' if node.case_sensitive else 'i'}:{node.regex})"
+            for node in pattern_nodes
+        )
+        merged_nodes.append(PatternNode(key, "re", regex, True))
+    return merged_nodes
+
+
+def _simplify_operands(
+    node_type: typing.Type[typing.Union[AndNode, OrNode]],
+    operands: typing.Iterable[Node],
+    neutral_value: bool,
+) -> Node:
+    """
+    Simplify the operands of an ``and`` or ``or`` operator.
+
+    Operands that are constants with the ``neutral_value`` (``True`` for
+    ``and``, ``False`` for ``or``) are removed. If any operand is a constant
+    with the opposite value, the whole operator evaluates to that constant.
+    Operands of the same type are flattened into the operands of the resulting
+    node.
+
+    :param node_type:
+        type of the node that is simplified (`AndNode` or `OrNode`).
+    :param operands:
+        operands of the node that is simplified.
+    :param neutral_value:
+        value of a constant operand that does not change the result.
+    :return:
+        simplified node.
+    """
+    simplified_operands: typing.List[Node] = []
+    for operand in operands:
+        operand = operand.simplify()
+        if isinstance(operand, ConstantNode):
+            if operand.value != neutral_value:
+                return operand
+            continue
+        if isinstance(operand, node_type):
+            simplified_operands.extend(operand.operands)
+        else:
+            simplified_operands.append(operand)
+    if not simplified_operands:
+        return ConstantNode(neutral_value)
+    if len(simplified_operands) == 1:
+        return simplified_operands[0]
+    return node_type(tuple(simplified_operands))
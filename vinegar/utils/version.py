@@ -5,17 +5,18 @@ Version strings provide a simple tool for finding out whether a specific
 resource has changed.
 
 Internally, they are calculated using the Murmur 3 hash function (if the `mmh3`
-module is available) or the MD5 hash function. Both these hash functions are
-designed in a way that accidental collisions are very unlikely.
+module is available) or the BLAKE2b hash function. Both these hash functions
+are designed in a way that accidental collisions are very unlikely. Version
+strings are opaque: their format may change between releases of Vinegar.
 
 Due to the nature of hash functions, a collision can never be avoided with
 absolute certainty, so version strings should only be used when the risk
 associated with using an outdated resource is acceptable.
 """
 
+import functools
 import os
 import pathlib
-import sys
 import typing
 
 
@@ -37,7 +38,7 @@ def aggregate_version(versions: typing.Iterable[str]) -> str:
 
 
 def version_for_file_path(
-    file_path: typing.Union[str, pathlib.PurePath]
+    file_path: typing.Union[str, pathlib.PurePath],
 ) -> str:
     """
     Return a version string for a file.
@@ -61,18 +62,22 @@ def version_for_file_path(
         file_path = str(file_path)
     try:
         file_stat = os.stat(file_path)
-        file_info = (
-            f"{file_path=},ctime={file_stat.st_ctime_ns},"
-            f"mtime={file_stat.st_mtime_ns},dev={file_stat.st_dev},"
-            f"ino={file_stat.st_ino},size={file_stat.st_size}"
-        )
-        return _hash_str(file_info)
-    except OSError:
+    except OSError as err:
         # If we cannot stat the file, we calculate the version based on the
         # file path only. We also encode the exception type, so that a file
         # that cannot be found has a different version string than a file that
         # exists but cannot be read.
-        return _hash_str(f"{file_path=},exception={sys.exc_info()[0]}")
+        return _hash_str(f"{file_path=},exception={type(err)}")
+    return _version_for_file_stat(
+        file_path,
+        (
+            file_stat.st_ctime_ns,
+            file_stat.st_mtime_ns,
+            file_stat.st_dev,
+            file_stat.st_ino,
+            file_stat.st_size,
+        ),
+    )
 
 
 def version_for_str(data: str) -> str:
@@ -91,10 +96,36 @@ def version_for_str(data: str) -> str:
     return _hash_str(data)
 
 
+# The same files are typically checked over and over again (e.g. for each
+# request), while they only change rarely. The version only depends on the
+# arguments, so we can cache it and only have to calculate the hash when the
+# file has changed. Each entry only uses a few hundred bytes, so the cache can
+# be large enough for all files that are typically used.
+@functools.lru_cache(maxsize=4096)
+def _version_for_file_stat(
+    file_path: str, file_stat: typing.Tuple[int, int, int, int, int]
+) -> str:
+    """
+    Return a version string for a file based on its path and status.
+
+    This is used by `version_for_file_path`. ``file_stat`` is the tuple
+    ``(st_ctime_ns, st_mtime_ns, st_dev, st_ino, st_size)``.
+    """
+    ctime_ns, mtime_ns, dev, ino, size = file_stat
+    file_info = (
+        f"{file_path=},ctime={ctime_ns},mtime={mtime_ns},dev={dev},"
+        f"ino={ino},size={size}"
+    )
+    return _hash_str(file_info)
+
+
 # Murmur3 is about twice as fast as MD5, but it is not available in the core
 # Python library. There is a Python-only variant of Murmur3, but that one is
-# actually slower than the built-in MD5. For this reason, we only use Murmur3
-# if the mmh3 package is available on the system. Otherwise, we use MD5.
+# actually slower than the built-in hash functions. For this reason, we only
+# use Murmur3 if the mmh3 package is available on the system. Otherwise, we use
+# BLAKE2b, which is at least as fast as MD5 for the short strings that are
+# typically hashed here. We limit its digest size to 128 bits, which is the
+# size of the Murmur3 hash and more than enough for detecting changes.
 try:
     import mmh3
 
@@ -105,6 +136,6 @@ except ImportError:
     import hashlib
 
     def _hash_str(data: str):
-        hasher = hashlib.md5()
-        hasher.update(data.encode(errors="ignore"))
-        return hasher.hexdigest()
+        return hashlib.blake2b(
+            data.encode(errors="ignore"), digest_size=16
+        ).hexdigest()
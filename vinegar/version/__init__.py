@@ -21,15 +21,14 @@ def _version_string():
     """
     Generate the version string based on the version number.
     """
-    version_string = ""
-    for component in VERSION:
-        if component >= 0:
-            version_string += f".{component}"
-        else:
-            # We assume that there is only one negative component in the
-            # version number.
-            version_string += f"b{component - BETA_VERSION_OFFSET}"
-    return version_string[1:]
+    # Only the last component may be negative (see BETA_VERSION_OFFSET).
+    *release, last = VERSION
+    if last < 0:
+        suffix = f"b{last - BETA_VERSION_OFFSET}"
+    else:
+        release.append(last)
+        suffix = ""
+    return ".".join(str(component) for component in release) + suffix
 
 
 #: Version (as a string)